@@ -1,4 +1,8 @@
 import npm_pipeline.analyser as npm_analyser
+import joern_helper
+import db_instance
+import llm
+import npm_pipeline.database as db_query
 from loggerManager import LoggerManager
 import os
 import argparse
@@ -6,10 +10,14 @@ from status import *
 
 
 def analyse(package_name, report_dir, code_dir, joern_dir, format_dir, log_pipeline: LoggerManager,
-            overwrite=True, generate_report=True):
+            overwrite=True, generate_report=True, cache_dir=None):
     status = npm_analyser.run(package_name=package_name, report_dir=report_dir, code_dir=code_dir,
                               joern_dir=joern_dir, format_dir=format_dir,
-                              overwrite=overwrite, generate_report=generate_report)
+                              overwrite=overwrite, generate_report=generate_report, cache_dir=cache_dir)
+    return log_status(package_name, status, log_pipeline)
+
+
+def log_status(package_name, status, log_pipeline: LoggerManager):
     if status == STATUS_JOERN_ERROR:
         log_pipeline.info(f"package: {package_name} Joern error")
     elif status == STATUS_MALICIOUS:
@@ -43,15 +51,44 @@ if __name__ == "__main__":
     parser.add_argument('-package_name', type=str)
     parser.add_argument('-report_dir', type=str)
     parser.add_argument('-joern_workspace', type=str)
+    parser.add_argument('-cache_dir', type=str, default=None)
+    parser.add_argument('-no_cache', '--no-cache', action='store_true')
+    parser.add_argument('-joern_server', type=str, default=None)
+    parser.add_argument('-cpg_format', type=str, default='dot', choices=['dot', 'graphson'])
+    parser.add_argument('-pdg_from_cpg', action='store_true')
+    parser.add_argument('-compact_cpg', action='store_true')
+    parser.add_argument('-reuse_workspace', action='store_true')
+    parser.add_argument('-run_time_workers', type=int, default=1)
+    parser.add_argument('-sqlite_db', type=str, default=None)
+    parser.add_argument('-llm_cache_dir', type=str, default=None)
+    parser.add_argument('-llm_backend', type=str, default='openai', choices=['openai', 'local', 'rule'])
+    parser.add_argument('-llm_endpoint', type=str, default=None)
+    parser.add_argument('-llm_model', type=str, default=None)
+    parser.add_argument('-no_categorise_on_scan', action='store_true')
     args = parser.parse_args()
     base_dir = args.base_dir
     package_dir = args.package_dir
     package_name = args.package_name
     report_dir = args.report_dir
     joern_workspace = args.joern_workspace
+    cache_dir = None if args.no_cache else args.cache_dir
+    if args.joern_server:
+        joern_helper.use_joern_server(args.joern_server)
+    joern_helper.set_cpg_format(args.cpg_format)
+    npm_analyser.set_pdg_from_cpg(args.pdg_from_cpg)
+    npm_analyser.set_compact_cpg(args.compact_cpg)
+    npm_analyser.set_run_time_workers(args.run_time_workers)
+    if args.sqlite_db:
+        db_instance.use_sqlite(args.sqlite_db)
+    if args.llm_cache_dir:
+        llm.use_cache(args.llm_cache_dir)
+    llm.set_backend(args.llm_backend, args.llm_endpoint, args.llm_model)
+    db_query.set_categorise_on_scan(not args.no_categorise_on_scan)
 
     _pipeline_log_dir = os.path.join(base_dir, 'run_info')
     _log_pipeline = LoggerManager('pipeline_info', _pipeline_log_dir, asctime=True, overwrite=False)
+    db_query.set_log_pipeline(_log_pipeline)
     _log_pipeline.info(f"Start Analyzing: {package_name}")
     _format_dir = os.path.join(base_dir, 'format')
-    analyse(package_name, report_dir, package_dir, joern_workspace, _format_dir, _log_pipeline)
+    analyse(package_name, report_dir, package_dir, joern_workspace, _format_dir, _log_pipeline,
+            overwrite=not args.reuse_workspace, cache_dir=cache_dir)
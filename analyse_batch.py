@@ -0,0 +1,225 @@
+import npm_pipeline.analyser as npm_analyser
+import npm_pipeline.database as db_query
+import joern_helper
+import db_instance
+import llm
+from loggerManager import LoggerManager
+from analyse import log_status
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing as mp
+import os
+import csv
+import time
+import argparse
+import traceback
+from status import *
+
+
+def collect_packages(package_dir: str, manifest: str = None) -> list[str]:
+    """
+    get the names of the packages to analyse
+    :param package_dir: the directory contains the NPM packages, one folder per package
+    :param manifest: optional file with one package name per line, '#' starts a comment
+    :return: package names
+    """
+    if manifest is not None:
+        package_names = []
+        with open(manifest, 'r') as manifest_file:
+            for line in manifest_file:
+                name = line.strip()
+                if name and not name.startswith('#'):
+                    package_names.append(name)
+        return package_names
+    return sorted(name for name in os.listdir(package_dir) if os.path.isdir(os.path.join(package_dir, name)))
+
+
+# packages started by the workers of a pool, it tells which packages a dead worker held
+_started = None
+
+
+def init_worker(options: dict, started=None):
+    """
+    :param options: settings of the analysis, keyword arguments of analyse_batch
+    :param started: queue of the started packages
+    """
+    global _started
+    _started = started
+
+    # every worker process runs the packages in its main thread, so the SIGALRM timeout of run() applies per package
+    npm_analyser.set_timeout_limit(options['timeout_limit'])
+    if options['joern_server']:
+        joern_helper.use_joern_server(options['joern_server'])
+    joern_helper.set_cpg_format(options['cpg_format'])
+    npm_analyser.set_pdg_from_cpg(options['pdg_from_cpg'])
+    npm_analyser.set_compact_cpg(options['compact_cpg'])
+    npm_analyser.set_run_time_workers(options['run_time_workers'])
+    if options['sqlite_db']:
+        db_instance.use_sqlite(options['sqlite_db'])
+    if options['llm_cache_dir']:
+        llm.use_cache(options['llm_cache_dir'])
+    llm.set_backend(*options['llm_backend'])
+    db_query.set_categorise_on_scan(options['categorise_on_scan'])
+
+
+def analyse_one(package_name, report_dir, code_dir, joern_dir, format_dir, overwrite, generate_report, cache_dir):
+    if _started is not None:
+        _started.put(package_name)
+    start = time.time()
+    try:
+        status = npm_analyser.run(package_name=package_name, report_dir=report_dir, code_dir=code_dir,
+                                  joern_dir=joern_dir, format_dir=format_dir,
+                                  overwrite=overwrite, generate_report=generate_report, cache_dir=cache_dir)
+    except Exception:
+        traceback.print_exc()
+        status = STATUS_PROGRAM_ERROR
+
+    # the updates of the knowledge base are written before the next package, a pool worker exits without atexit
+    db_query.flush()
+    return package_name, status, time.time() - start
+
+
+def run_pool(package_names: list[str], workers: int, options: dict, task_args: tuple, on_result):
+    """
+    analyse the packages in one process pool, until all of them are done or a worker dies
+    :param task_args: arguments of analyse_one after the package name
+    :param on_result: called with package name, status and seconds of every finished package
+    :return: packages held by the workers when the pool broke, packages not started
+    """
+    started = mp.SimpleQueue()
+    finished = set()
+    broken = False
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(options, started)) as executor:
+        futures = {executor.submit(analyse_one, package_name, *task_args): package_name
+                   for package_name in package_names}
+        for future in as_completed(futures):
+            try:
+                on_result(*future.result())
+            except BrokenProcessPool:
+                # a worker died, e.g. killed by the OOM killer, every pending package of the pool fails with it
+                broken = True
+                continue
+            except Exception as e:
+                print(f"package: {futures[future]} worker error: {e}")
+                on_result(futures[future], STATUS_PROGRAM_ERROR, 0)
+            finished.add(futures[future])
+    if not broken:
+        return [], []
+    running = set()
+    while not started.empty():
+        running.add(started.get())
+    unfinished = [package_name for package_name in package_names if package_name not in finished]
+    return ([package_name for package_name in unfinished if package_name in running],
+            [package_name for package_name in unfinished if package_name not in running])
+
+
+def analyse_batch(package_names: list[str], report_dir, code_dir, joern_dir, format_dir,
+                  log_pipeline: LoggerManager, status_path: str, workers: int = None,
+                  timeout_limit: int = npm_analyser.timeout_limit, overwrite=True, generate_report=True,
+                  cache_dir: str = None, joern_server: str = None, cpg_format: str = 'dot', pdg_from_cpg: bool = False,
+                  compact_cpg: bool = False, run_time_workers: int = 1, sqlite_db: str = None,
+                  llm_cache_dir: str = None, llm_backend: tuple = ('openai', None, None),
+                  categorise_on_scan: bool = True):
+    """
+    analyse many packages with a process pool and write one status table,
+    when a worker dies the packages it may have held are run again one at a time and the others in a new pool
+    :param package_names: packages to analyse
+    :param status_path: csv file of the aggregated status
+    :param workers: number of worker processes, default is the number of cores
+    :param timeout_limit: time limit of a single package in seconds
+    :param cache_dir: directory of the result cache, None disables the cache
+    :param joern_server: host:port of running Joern servers separated by commas, None runs joern-parse and joern-export
+    :param cpg_format: export format of the full cpg, dot or graphson
+    :param pdg_from_cpg: derive the pdgs from the full cpg instead of exporting them per method
+    :param compact_cpg: load the cpg into the array-backed CompactCPG
+    :param run_time_workers: processes of the run-time analysis inside one package worker
+    :param sqlite_db: SQLite database of the api tables, None uses the MySQL server of db_instance
+    :param llm_cache_dir: directory of the llm answer cache shared by the workers, None disables it
+    :param llm_backend: name, endpoint and model of the llm backend, see llm.set_backend
+    :param categorise_on_scan: categorise the apis without category during the scan
+    :return: dict of package name and status
+    """
+    statuses = {}
+    options = {'timeout_limit': timeout_limit, 'joern_server': joern_server, 'cpg_format': cpg_format,
+               'pdg_from_cpg': pdg_from_cpg, 'compact_cpg': compact_cpg, 'run_time_workers': run_time_workers,
+               'sqlite_db': sqlite_db, 'llm_cache_dir': llm_cache_dir, 'llm_backend': llm_backend,
+               'categorise_on_scan': categorise_on_scan}
+    task_args = (report_dir, code_dir, joern_dir, format_dir, overwrite, generate_report, cache_dir)
+    with open(status_path, 'w', newline='') as status_file:
+        writer = csv.writer(status_file)
+        writer.writerow(['package', 'status', 'seconds'])
+
+        def on_result(package_name, status, elapsed):
+            log_status(package_name, status, log_pipeline)
+            statuses[package_name] = status
+            writer.writerow([package_name, status, f"{elapsed:.2f}"])
+            status_file.flush()
+
+        def on_worker_died(package_name):
+            log_pipeline.error(f"package: {package_name} worker process died")
+            on_result(package_name, STATUS_PROGRAM_ERROR, 0)
+
+        pending = list(package_names)
+        while pending:
+            suspects, not_started = run_pool(pending, workers, options, task_args, on_result)
+
+            # a package run alone that kills its worker is the one that killed the pool
+            for package_name in suspects:
+                crashed, lost = run_pool([package_name], 1, options, task_args, on_result)
+                if crashed or lost:
+                    on_worker_died(package_name)
+            if not_started and not suspects:
+                # the pool broke before any package started, e.g. in init_worker
+                for package_name in not_started:
+                    on_worker_died(package_name)
+                break
+            pending = not_started
+    return statuses
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-base_dir', type=str)
+    parser.add_argument('-package_dir', type=str)
+    parser.add_argument('-manifest', type=str, default=None)
+    parser.add_argument('-report_dir', type=str)
+    parser.add_argument('-joern_workspace', type=str)
+    parser.add_argument('-workers', type=int, default=None)
+    parser.add_argument('-timeout', type=int, default=npm_analyser.timeout_limit)
+    parser.add_argument('-status_file', type=str, default=None)
+    parser.add_argument('-cache_dir', type=str, default=None)
+    parser.add_argument('-no_cache', '--no-cache', action='store_true')
+    parser.add_argument('-joern_server', type=str, default=None)
+    parser.add_argument('-spawn_joern_server', action='store_true')
+    parser.add_argument('-cpg_format', type=str, default='dot', choices=['dot', 'graphson'])
+    parser.add_argument('-pdg_from_cpg', action='store_true')
+    parser.add_argument('-compact_cpg', action='store_true')
+    parser.add_argument('-reuse_workspace', action='store_true')
+    parser.add_argument('-run_time_workers', type=int, default=1)
+    parser.add_argument('-sqlite_db', type=str, default=None)
+    parser.add_argument('-llm_cache_dir', type=str, default=None)
+    parser.add_argument('-llm_backend', type=str, default='openai', choices=['openai', 'local', 'rule'])
+    parser.add_argument('-llm_endpoint', type=str, default=None)
+    parser.add_argument('-llm_model', type=str, default=None)
+    parser.add_argument('-no_categorise_on_scan', action='store_true')
+    args = parser.parse_args()
+    base_dir = args.base_dir
+
+    _pipeline_log_dir = os.path.join(base_dir, 'run_info')
+    _log_pipeline = LoggerManager('pipeline_info', _pipeline_log_dir, asctime=True, overwrite=False)
+    db_query.set_log_pipeline(_log_pipeline)
+    _format_dir = os.path.join(base_dir, 'format')
+    _status_path = args.status_file if args.status_file else os.path.join(base_dir, 'batch_status.csv')
+    _package_names = collect_packages(args.package_dir, args.manifest)
+    _log_pipeline.info(f"Start Analyzing {len(_package_names)} packages")
+    if args.joern_server and args.spawn_joern_server:
+        joern_helper.use_joern_server(args.joern_server, spawn=True)
+    analyse_batch(_package_names, args.report_dir, args.package_dir, args.joern_workspace, _format_dir,
+                  _log_pipeline, _status_path, workers=args.workers, timeout_limit=args.timeout,
+                  overwrite=not args.reuse_workspace,
+                  cache_dir=None if args.no_cache else args.cache_dir, joern_server=args.joern_server,
+                  cpg_format=args.cpg_format, pdg_from_cpg=args.pdg_from_cpg,
+                  compact_cpg=args.compact_cpg, run_time_workers=args.run_time_workers,
+                  sqlite_db=args.sqlite_db, llm_cache_dir=args.llm_cache_dir,
+                  llm_backend=(args.llm_backend, args.llm_endpoint, args.llm_model),
+                  categorise_on_scan=not args.no_categorise_on_scan)
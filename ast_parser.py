@@ -1,13 +1,49 @@
 from __future__ import annotations
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 from typing import Generator
-from tree_sitter import Language, Parser, Node
+from tree_sitter import Language, Parser, Node, Query
 import tree_sitter_javascript as tsjavascript
 
+JS_LANGUAGE = Language(tsjavascript.language())
+
+# a parser is not shared between threads
+_parsers = threading.local()
+
+
+def get_parser() -> Parser:
+    """
+    parser of the current thread, it is reused for every snippet
+    """
+    parser = getattr(_parsers, 'parser', None)
+    if parser is None:
+        parser = Parser(JS_LANGUAGE)
+        _parsers.parser = parser
+    return parser
+
+
+@lru_cache(maxsize=512)
+def compile_query(query_str: str) -> Query:
+    """
+    compiled query of the query text, the queries are fixed strings so the cache keeps all of them
+    """
+    return JS_LANGUAGE.query(query_str)
+
+
+def combine_queries(queries: dict[str, str]) -> str:
+    """
+    one query with the patterns of all the queries, a capture @name in queries[key] is renamed to @key.name
+    """
+    return '\n'.join(re.sub(r'@([\w.]+)', lambda match: f'@{key}.{match.group(1)}', query_str)
+                     for key, query_str in queries.items())
+
 
 class ASTParser:
     def __init__(self, code: str, language: str):
-        self.LANGUAGE = Language(tsjavascript.language())
-        self.parser = Parser(self.LANGUAGE)
+        self.LANGUAGE = JS_LANGUAGE
+        self.parser = get_parser()
         self.tree = self.parser.parse(bytes(code, "utf-8"))
         self.root = self.tree.root_node
 
@@ -27,7 +63,7 @@ class ASTParser:
         return None
 
     def query_oneshot(self, query_str: str) -> Node | None:
-        query = self.LANGUAGE.query(query_str)
+        query = compile_query(query_str)
         captures = query.captures(self.root)
         result = None
         for capture in captures:
@@ -36,7 +72,7 @@ class ASTParser:
         return result
 
     def query_last_one(self, query_str: str) -> Node | None:
-        query = self.LANGUAGE.query(query_str)
+        query = compile_query(query_str)
         captures = query.captures(self.root)
         result = None
         for i in range(len(captures) - 1, -1, -1):
@@ -45,10 +81,21 @@ class ASTParser:
         return result
 
     def query(self, query_str: str):
-        query = self.LANGUAGE.query(query_str)
+        query = compile_query(query_str)
         captures = query.captures(self.root)
         return captures
 
+    def query_by_prefix(self, query_str: str) -> dict[str, list[tuple[Node, str]]]:
+        """
+        run a query of combine_queries
+        :return: key: key of the query, value: its captures in the order of query, without the key prefix
+        """
+        captures_by_key = {}
+        for node, name in compile_query(query_str).captures(self.root):
+            key, _, capture_name = name.partition('.')
+            captures_by_key.setdefault(key, []).append((node, capture_name))
+        return captures_by_key
+
     def traverse_tree(self) -> Generator[Node, None, None]:
         cursor = self.tree.walk()
 
@@ -105,3 +152,63 @@ class ASTParser:
                 return parent.start_point.row, parent.start_point.column
             parent = parent.parent
         return None
+
+
+class ASTCache:
+    """
+    parsed snippets and source files of one package, the same code is parsed only once
+    """
+
+    def __init__(self, max_snippets: int = 4096, max_tail_parsers: int = 128):
+        self.max_snippets = max_snippets
+        self.max_tail_parsers = max_tail_parsers
+
+        # key: code of the snippet, least recently used first
+        self.snippets: OrderedDict[str, ASTParser] = OrderedDict()
+
+        # key: file path
+        self.file_lines: dict[str, list[str]] = {}
+        self.file_parsers: dict[str, ASTParser] = {}
+
+        # key: (file path, line number, column number), the code from the position to the end of the file,
+        # least recently used first
+        self.tail_parsers: OrderedDict[tuple[str, int, int], ASTParser] = OrderedDict()
+
+    def parse(self, code: str) -> ASTParser:
+        parser = self.snippets.get(code)
+        if parser is None:
+            parser = ASTParser(code, 'javascript')
+            self.snippets[code] = parser
+            if len(self.snippets) > self.max_snippets:
+                self.snippets.popitem(last=False)
+        else:
+            self.snippets.move_to_end(code)
+        return parser
+
+    def read_lines(self, file_path: str) -> list[str]:
+        if file_path not in self.file_lines:
+            with open(file_path, 'r') as file:
+                self.file_lines[file_path] = file.readlines()
+        return self.file_lines[file_path]
+
+    def parse_file(self, file_path: str) -> ASTParser:
+        if file_path not in self.file_parsers:
+            self.file_parsers[file_path] = ASTParser(''.join(self.read_lines(file_path)), 'javascript')
+        return self.file_parsers[file_path]
+
+    def parse_from(self, file_path: str, start_line: int, start_column: int) -> ASTParser:
+        """
+        parse the code of the file from the line (1-based) and the column to the end of the file
+        """
+        key = (file_path, start_line, start_column)
+        parser = self.tail_parsers.get(key)
+        if parser is None:
+            lines = self.read_lines(file_path)
+            code = lines[start_line - 1][start_column:] + ''.join(lines[start_line:])
+            parser = ASTParser(code, 'javascript')
+            self.tail_parsers[key] = parser
+            if len(self.tail_parsers) > self.max_tail_parsers:
+                self.tail_parsers.popitem(last=False)
+        else:
+            self.tail_parsers.move_to_end(key)
+        return parser
@@ -0,0 +1,119 @@
+import os
+import csv
+import time
+import sqlite3
+import argparse
+import db_instance
+import llm
+import csv2sqlite
+from db_instance import DatabaseConnection
+from npm_pipeline.database import categorise_async
+
+
+def categorise_table(ecosystem: str, cat: str, batch_size: int = 200, limit: int = None):
+    """
+    categorise the rows without category of a table, the llm requests of a batch are sent concurrently
+    and the categories of the batch are written in one transaction
+    :param ecosystem: npm or pypi
+    :param cat: builtin or third
+    :param batch_size: rows per batch
+    :param limit: maximum number of rows, None for all
+    :return: number of categorised rows
+    """
+    with DatabaseConnection('remote') as db:
+        columns, rows = db.uncategorised(ecosystem, cat)
+    rows = rows[:limit] if limit is not None else rows
+    print(f"{ecosystem}_{cat}: {len(rows)} rows without category")
+    id_index = columns.index('id')
+    categorised = 0
+    start = time.time()
+    for batch_start in range(0, len(rows), batch_size):
+        batch = rows[batch_start: batch_start + batch_size]
+        results = llm.gather([categorise_async_or_none(row, cat) for row in batch])
+        categories = []
+        summaries = []
+        for row, result in zip(batch, results):
+            if result is None:
+                continue
+            _, category_string, code_summary = result
+            categories.append((row[id_index], category_string))
+            if code_summary is not None:
+                summaries.append((row[id_index], code_summary))
+        with DatabaseConnection('remote') as db, db.transaction():
+            db.update_many(ecosystem, cat, 'category', categories)
+            if summaries:
+                db.update_many(ecosystem, cat, 'summary', summaries)
+        categorised += len(categories)
+        print(f"{ecosystem}_{cat}: {batch_start + len(batch)}/{len(rows)} rows, {time.time() - start:.1f}s")
+    return categorised
+
+
+async def categorise_async_or_none(row, cat):
+    # a failed row stays without category and is tried again by the next run
+    try:
+        return await categorise_async(row, cat)
+    except Exception as e:
+        print(f"row {row[0]} failed: {e}")
+        return None
+
+
+def export_csv(ecosystem: str, cat: str, csv_path: str):
+    """
+    write a table with its header to a csv file
+    """
+    with DatabaseConnection('remote') as db:
+        columns, rows = db.table(ecosystem, cat)
+    with open(csv_path, 'w', newline='', encoding='utf-8') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(columns)
+        writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-ecosystem', type=str, default='npm')
+    parser.add_argument('-tables', type=str, nargs='+', default=['builtin', 'third'], choices=['builtin', 'third'])
+    parser.add_argument('-sqlite_db', type=str, default=None)
+    parser.add_argument('-import_csv', action='store_true')
+    parser.add_argument('-csv_dir', type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'csv'))
+    parser.add_argument('-replace', action='store_true')
+    parser.add_argument('-export_csv', action='store_true')
+    parser.add_argument('-export_dir', type=str,
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'csv', 'categorised'))
+    parser.add_argument('-batch_size', type=int, default=200)
+    parser.add_argument('-concurrency', type=int, default=llm.max_concurrency)
+    parser.add_argument('-limit', type=int, default=None)
+    parser.add_argument('-llm_cache_dir', type=str, default=None)
+    parser.add_argument('-llm_backend', type=str, default='openai', choices=['openai', 'local', 'rule'])
+    parser.add_argument('-llm_endpoint', type=str, default=None)
+    parser.add_argument('-llm_model', type=str, default=None)
+    args = parser.parse_args()
+
+    if args.sqlite_db:
+        if args.import_csv:
+            _connection = sqlite3.connect(args.sqlite_db)
+            csv2sqlite.create_tables(_connection, args.ecosystem)
+            for _cat in args.tables:
+                _csv_path = os.path.join(args.csv_dir, f'{args.ecosystem}_{_cat}.csv')
+                if not os.path.exists(_csv_path):
+                    continue
+                # a table already filled keeps its categories of the previous runs, unless -replace
+                if not args.replace and \
+                        _connection.execute(f"SELECT 1 FROM {args.ecosystem}_{_cat} LIMIT 1").fetchone():
+                    print(f"{args.ecosystem}_{_cat}: not empty, skip the import")
+                    continue
+                print(f"{args.ecosystem}_{_cat}: "
+                      f"{csv2sqlite.import_csv(_connection, _csv_path, f'{args.ecosystem}_{_cat}', True)} rows")
+            _connection.close()
+        db_instance.use_sqlite(args.sqlite_db)
+    llm.max_concurrency = args.concurrency
+    if args.llm_cache_dir:
+        llm.use_cache(args.llm_cache_dir)
+    llm.set_backend(args.llm_backend, args.llm_endpoint, args.llm_model)
+
+    for _cat in args.tables:
+        print(f"{args.ecosystem}_{_cat}: {categorise_table(args.ecosystem, _cat, args.batch_size, args.limit)} "
+              f"rows categorised")
+        if args.export_csv:
+            os.makedirs(args.export_dir, exist_ok=True)
+            export_csv(args.ecosystem, _cat, os.path.join(args.export_dir, f'{args.ecosystem}_{_cat}.csv'))
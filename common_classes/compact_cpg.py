@@ -0,0 +1,268 @@
+from __future__ import annotations
+
+from array import array
+import numpy as np
+from common_classes.cpg import CPG
+from common_classes.cpg_reader import read_cpg
+
+# the property values of one edge are interned as a single string
+PROPERTY_SEPARATOR = '\0'
+
+
+class CompactCPGNode:
+    """
+    read-only view of one node in CompactCPG, it has the same getters as CPGNode
+    """
+    __slots__ = ('cpg', 'index', 'node_id')
+
+    def __init__(self, cpg: CompactCPG, index: int):
+        self.cpg = cpg
+        self.index = index
+        self.node_id = int(cpg.node_ids[index])
+
+    def get_id(self) -> int:
+        return self.node_id
+
+    def get_attr(self) -> dict:
+        return self.cpg.node_attr(self.index)
+
+    def get_value(self, key: str) -> str | None:
+        return self.cpg.node_value(self.index, key)
+
+
+class CompactCPG:
+    """
+    array-backed cpg with the same lookups as CPG:
+    node ids are sorted and the position of a node is its index, strings are interned once,
+    every attribute is a sparse column of (node index, string code),
+    out edges are in CSR form (indptr, tail index, label code, property code) with a bitmask of the edge labels per node
+    """
+
+    def __init__(self, cpg_dir: str):
+        self.cpg_dir = cpg_dir
+        self.strings: list[str] = []
+        string_codes: dict[str, int] = {}
+        self.edge_labels: list[str] = []
+        self.edge_label_codes: dict[str, int] = {}
+
+        def intern(value: str) -> int:
+            code = string_codes.get(value)
+            if code is None:
+                code = len(self.strings)
+                string_codes[value] = code
+                self.strings.append(value)
+            return code
+
+        # read the dot or GraphSON export of the cpg
+        nodes, edges = read_cpg(cpg_dir)
+        node_ids = array('q')
+        columns: dict[str, tuple[array, array]] = {}
+        last_node_id = 0
+        for node_id, attr in nodes:
+            row = len(node_ids)
+            node_ids.append(node_id)
+            last_node_id = node_id
+            for key, value in attr.items():
+                if key not in columns:
+                    columns[key] = (array('q'), array('q'))
+                columns[key][0].append(row)
+                columns[key][1].append(intern(value))
+
+        edge_src = array('q')
+        edge_dst = array('q')
+        edge_label = array('q')
+        edge_property = array('q')
+        for src, dst, edge_attr in edges:
+
+            # an attribute list is the label followed by the property values
+            label = edge_attr[0]
+            if label not in self.edge_label_codes:
+                if len(self.edge_labels) == 64:
+                    raise ValueError(f"more than 64 edge labels in {cpg_dir}")
+                self.edge_label_codes[label] = len(self.edge_labels)
+                self.edge_labels.append(label)
+            edge_src.append(src)
+            edge_dst.append(dst)
+            edge_label.append(self.edge_label_codes[label])
+            edge_property.append(intern(PROPERTY_SEPARATOR.join(edge_attr[1:])) if len(edge_attr) > 1 else -1)
+        self.method_code = string_codes.get('METHOD', -1)
+
+        # nodes are sorted by id, the position of a node is its index
+        ids = np.frombuffer(node_ids, dtype=np.int64)
+        order = np.argsort(ids, kind='stable')
+        self.node_ids: np.ndarray = ids[order]
+        rank = np.empty(len(order), dtype=np.int32)
+        rank[order] = np.arange(len(order), dtype=np.int32)
+        self.max_node_id = last_node_id
+
+        # key: attribute name, value: (sorted node indices, string codes)
+        self.columns: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+        for key, (rows, codes) in columns.items():
+            node_index = rank[np.frombuffer(rows, dtype=np.int64)]
+            column_order = np.argsort(node_index, kind='stable')
+            self.columns[key] = (node_index[column_order],
+                                 np.frombuffer(codes, dtype=np.int64)[column_order].astype(np.int32))
+        del columns
+
+        # edges between known nodes, grouped by the head
+        src_index = self.__lookup(np.frombuffer(edge_src, dtype=np.int64))
+        dst_index = self.__lookup(np.frombuffer(edge_dst, dtype=np.int64))
+        known = (src_index >= 0) & (dst_index >= 0)
+        src_index = src_index[known]
+        labels = np.frombuffer(edge_label, dtype=np.int64)[known].astype(np.uint8)
+        edge_order = np.argsort(src_index, kind='stable')
+        self.out_indptr = np.zeros(len(self.node_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src_index, minlength=len(self.node_ids)), out=self.out_indptr[1:])
+        self.out_tail: np.ndarray = dst_index[known][edge_order].astype(np.int32)
+        self.out_label: np.ndarray = labels[edge_order]
+        self.out_property: np.ndarray = np.frombuffer(edge_property, dtype=np.int64)[known][edge_order].astype(np.int32)
+
+        # bit i is set if the node has an out edge labelled edge_labels[i]
+        self.out_label_mask = np.zeros(len(self.node_ids), dtype=np.uint64)
+        np.bitwise_or.at(self.out_label_mask, src_index, np.left_shift(np.uint64(1), labels.astype(np.uint64)))
+
+        # the ast children are sorted by ORDER and the arguments by ARGUMENT_INDEX once, the lookups are slices
+        self.ast_indptr, self.ast_tail = self.__sorted_adjacency('AST', 'ORDER')
+        self.argument_indptr, self.argument_tail = self.__sorted_adjacency('ARGUMENT', 'ARGUMENT_INDEX')
+
+    def __lookup(self, node_ids: np.ndarray) -> np.ndarray:
+        """
+        index of every node id, -1 for unknown nodes
+        """
+        if len(self.node_ids) == 0:
+            return np.full(len(node_ids), -1, dtype=np.int64)
+        index = np.minimum(np.searchsorted(self.node_ids, node_ids), len(self.node_ids) - 1)
+        return np.where(self.node_ids[index] == node_ids, index, -1)
+
+    def __int_column(self, key: str) -> np.ndarray:
+        """
+        integer value of the attribute of every node, 0 if the node does not have it
+        """
+        values = np.zeros(len(self.node_ids), dtype=np.int64)
+        if key in self.columns:
+            rows, codes = self.columns[key]
+            unique_codes, inverse = np.unique(codes, return_inverse=True)
+            unique_values = np.array([int(self.strings[code]) for code in unique_codes.tolist()], dtype=np.int64)
+            values[rows] = unique_values[inverse]
+        return values
+
+    def __sorted_adjacency(self, label: str, key: str) -> tuple[np.ndarray, np.ndarray]:
+        """
+        out edges with the label in CSR form (indptr, tail index), the tails of a node ascending by the attribute
+        """
+        heads = np.repeat(np.arange(len(self.node_ids), dtype=np.int64), np.diff(self.out_indptr))
+        code = self.edge_label_codes.get(label)
+        selected = self.out_label == code if code is not None else np.zeros(len(self.out_tail), dtype=bool)
+        heads = heads[selected]
+        tails = self.out_tail[selected]
+
+        # lexsort is stable, the tails with the same value keep the order of the export
+        order = np.lexsort((self.__int_column(key)[tails], heads))
+        indptr = np.zeros(len(self.node_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(heads, minlength=len(self.node_ids)), out=indptr[1:])
+        return indptr, tails[order]
+
+    def __index(self, node_id: int) -> int:
+        index = int(np.searchsorted(self.node_ids, node_id))
+        if index == len(self.node_ids) or self.node_ids[index] != node_id:
+            raise KeyError(node_id)
+        return index
+
+    def node_value(self, index: int, key: str) -> str | None:
+        if key not in self.columns:
+            return None
+        rows, codes = self.columns[key]
+        position = int(np.searchsorted(rows, index))
+        if position == len(rows) or rows[position] != index:
+            return None
+        return self.strings[codes[position]]
+
+    def node_attr(self, index: int) -> dict:
+        attr = {}
+        for key in self.columns:
+            value = self.node_value(index, key)
+            if value is not None:
+                attr[key] = value
+        return attr
+
+    def __tails(self, node_id: int, label: str) -> list[int]:
+        """
+        indices of the tails of the out edges with the label
+        """
+        index = self.__index(node_id)
+        code = self.edge_label_codes.get(label)
+        if code is None or not int(self.out_label_mask[index]) >> code & 1:
+            return []
+        start, end = self.out_indptr[index], self.out_indptr[index + 1]
+        return self.out_tail[start:end][self.out_label[start:end] == code].tolist()
+
+    def get_node(self, node_id: int) -> CompactCPGNode:
+        return CompactCPGNode(self, self.__index(node_id))
+
+    def get_child_ast(self, node_id: int) -> list[CompactCPGNode]:
+        """
+        get ast nodes, ascending by ORDER
+        """
+        index = self.__index(node_id)
+        tails = self.ast_tail[self.ast_indptr[index]:self.ast_indptr[index + 1]]
+        return [CompactCPGNode(self, tail) for tail in tails.tolist()]
+
+    def get_argument(self, node_id: int) -> list[CompactCPGNode]:
+        """
+        get argument type edge, ascending by ARGUMENT_INDEX
+        """
+        index = self.__index(node_id)
+        tails = self.argument_tail[self.argument_indptr[index]:self.argument_indptr[index + 1]]
+        return [CompactCPGNode(self, tail) for tail in tails.tolist()]
+
+    def get_call(self, node_id: int) -> CompactCPGNode | None:
+        """
+        get call type edge
+        """
+        tails = self.__tails(node_id, 'CALL')
+        return CompactCPGNode(self, tails[-1]) if tails else None
+
+    def get_method_ids(self) -> list[int]:
+        """
+        ids of the internal METHOD nodes
+        """
+        method_ids = []
+        if 'label' not in self.columns:
+            return method_ids
+        rows, codes = self.columns['label']
+        for index in rows[codes == self.method_code].tolist():
+            if self.node_value(index, 'IS_EXTERNAL') != 'true':
+                method_ids.append(int(self.node_ids[index]))
+        return method_ids
+
+    def get_successors(self, node_id: int) -> set[int]:
+        index = self.__index(node_id)
+        start, end = self.out_indptr[index], self.out_indptr[index + 1]
+        return set(self.node_ids[self.out_tail[start:end]].tolist())
+
+    def get_edge_attr(self, src: int, dst: int) -> list[str]:
+        """
+        labels and property values of all the edges from src to dst, in the same layout as Edge.get_attr of CPG
+        """
+        index = self.__index(src)
+        dst_index = self.__index(dst)
+        start, end = self.out_indptr[index], self.out_indptr[index + 1]
+        attr = []
+        for position in np.nonzero(self.out_tail[start:end] == dst_index)[0].tolist():
+            attr.append(self.edge_labels[self.out_label[start + position]])
+            if self.out_property[start + position] >= 0:
+                attr.extend(self.strings[self.out_property[start + position]].split(PROPERTY_SEPARATOR))
+        return attr
+
+    def get_max_node_id(self):
+        self.max_node_id += 1
+        return self.max_node_id
+
+
+def load_cpg(cpg_dir: str, compact: bool = False) -> CPG | CompactCPG:
+    """
+    :param compact: load into the array-backed CompactCPG instead of CPG
+    """
+    if compact:
+        return CompactCPG(cpg_dir)
+    return CPG(cpg_dir)
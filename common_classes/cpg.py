@@ -2,8 +2,7 @@ from __future__ import annotations
 
 from common_classes.cpg_node import CPGNode
 from common_classes.cpg_pdg_edge import Edge
-import os
-import networkx as nx
+from common_classes.cpg_reader import read_cpg
 
 
 class CPG:
@@ -15,25 +14,24 @@ class CPG:
         self.in_edges: dict[int, set[int]] = {}
         self.max_node_id = 0
 
-        cpg_path = os.path.join(cpg_dir, 'export.dot')
-        if not os.path.exists(cpg_path):
-            raise FileNotFoundError(f"export.dot is not found in {cpg_path}")
+        # adjacency by edge type, the ast children are sorted by ORDER and the arguments by ARGUMENT_INDEX
+        self.ast_children: dict[int, list[CPGNode]] = {}
+        self.arguments: dict[int, list[CPGNode]] = {}
+        self.calls: dict[int, CPGNode] = {}
 
-        cpg: nx.MultiDiGraph = nx.nx_agraph.read_dot(cpg_path)
-        for node in cpg.nodes:
+        # read the dot or GraphSON export of the cpg
+        nodes, edges = read_cpg(cpg_dir)
+        for node_id, attr in nodes:
 
             # read the node info in CPG
-            node_id = int(node)
             cpg_node = CPGNode(node_id)
-            for key, value in cpg.nodes[node].items():
+            for key, value in attr.items():
                 cpg_node.set_attr(key, value)
             self.nodes[node_id] = cpg_node
             self.max_node_id = node_id
 
         # read all edges in cpg
-        for head, tail, key, edge_dict in cpg.edges(data=True, keys=True):
-            src = int(head)
-            dst = int(tail)
+        for src, dst, edge_attr in edges:
             if (src, dst) not in self.edges:
                 cpg_edge = Edge((src, dst))
             else:
@@ -53,57 +51,58 @@ class CPG:
             else:
                 self.in_edges[dst].add(src)
 
-            for _key, _value in edge_dict.items():
+            for _value in edge_attr:
                 cpg_edge.set_attr(_value)
             self.edges[(src, dst)] = cpg_edge
+            if dst in self.nodes:
+                self.__index_edge(src, dst, edge_attr[0])
+
+        for children in self.ast_children.values():
+            children.sort(key=lambda x: int(x.get_value('ORDER')))
+        for arguments in self.arguments.values():
+            arguments.sort(key=lambda x: int(x.get_value('ARGUMENT_INDEX')))
+
+    def __index_edge(self, src: int, dst: int, label: str):
+        if label == 'AST':
+            self.ast_children.setdefault(src, []).append(self.nodes[dst])
+        elif label == 'ARGUMENT':
+            self.arguments.setdefault(src, []).append(self.nodes[dst])
+        elif label == 'CALL':
+            self.calls[src] = self.nodes[dst]
 
     def get_node(self, node_id: int) -> CPGNode:
         return self.nodes[node_id]
 
     def get_child_ast(self, node_id: int) -> list[CPGNode]:
         """
-        get ast nodes
+        get ast nodes, ascending by ORDER
         """
-        nodes_id = self.out_edges[node_id]
-        ast = []
-        for tail_id in nodes_id:
-            edge = self.edges[(node_id, tail_id)]
-            attr = edge.get_attr()
-            for item in attr:
-                if item == 'AST':
-                    ast.append(self.nodes[tail_id])
-
-        # ascend
-        return sorted(ast, key=lambda x: int(x.get_value('ORDER')))
+        return self.ast_children.get(node_id, [])
 
     def get_argument(self, node_id: int) -> list[CPGNode]:
         """
-        get argument type edge
+        get argument type edge, ascending by ARGUMENT_INDEX
         """
-        nodes_id = self.out_edges[node_id]
-        ast = []
-        for tail_id in nodes_id:
-            edge = self.edges[(node_id, tail_id)]
-            attr = edge.get_attr()
-            for item in attr:
-                if item == 'ARGUMENT':
-                    ast.append(self.nodes[tail_id])
-        ast = sorted(ast, key=lambda x: int(x.get_value('ARGUMENT_INDEX')))
-        return ast
+        return self.arguments.get(node_id, [])
 
     def get_call(self, node_id: int) -> CPGNode | None:
         """
         get call type edge
         """
-        nodes_id = self.out_edges[node_id]
-        call_node = None
-        for tail_id in nodes_id:
-            edge = self.edges[(node_id, tail_id)]
-            attr = edge.get_attr()
-            for item in attr:
-                if item == 'CALL':
-                    call_node = self.nodes[tail_id]
-        return call_node
+        return self.calls.get(node_id)
+
+    def get_method_ids(self) -> list[int]:
+        """
+        ids of the internal METHOD nodes
+        """
+        return [node_id for node_id, node in self.nodes.items()
+                if node.get_value('label') == 'METHOD' and node.get_value('IS_EXTERNAL') != 'true']
+
+    def get_successors(self, node_id: int) -> set[int]:
+        return self.out_edges.get(node_id, set())
+
+    def get_edge_attr(self, src: int, dst: int) -> list[str]:
+        return self.edges[(src, dst)].get_attr()
 
     def get_max_node_id(self):
         self.max_node_id += 1
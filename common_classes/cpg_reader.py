@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import json
+import os
+from typing import Iterator
+import networkx as nx
+
+# node: (node id, attributes), edge: (head, tail, attribute values)
+NodeRecord = tuple[int, dict[str, str]]
+EdgeRecord = tuple[int, int, list[str]]
+
+
+# file of the full cpg per export format, the format of the current run decides which one is read,
+# so that a file left by an export in the other format is not used
+CPG_FILES = {'dot': 'export.dot', 'graphson': 'export.json'}
+cpg_format = 'dot'
+
+
+def set_cpg_format(export_format: str):
+    """
+    :param export_format: dot or graphson
+    """
+    global cpg_format
+    if export_format not in CPG_FILES:
+        raise ValueError(f"unsupported cpg format: {export_format}")
+    cpg_format = export_format
+
+
+def find_cpg_file(cpg_dir: str) -> str:
+    cpg_path = os.path.join(cpg_dir, CPG_FILES[cpg_format])
+    if os.path.exists(cpg_path):
+        return cpg_path
+    other_files = [file for export_format, file in CPG_FILES.items() if export_format != cpg_format and
+                   os.path.exists(os.path.join(cpg_dir, file))]
+    raise FileNotFoundError(f"{CPG_FILES[cpg_format]} ({cpg_format}) is not found in {cpg_dir}" +
+                            (f", found {', '.join(other_files)} of another format" if other_files else ''))
+
+
+def read_cpg(cpg_dir: str) -> tuple[Iterator[NodeRecord], Iterator[EdgeRecord]]:
+    cpg_path = find_cpg_file(cpg_dir)
+    if cpg_path.endswith('.json'):
+        return read_graphson(cpg_path)
+    else:
+        return read_dot(cpg_path)
+
+
+def read_dot(cpg_path: str) -> tuple[Iterator[NodeRecord], Iterator[EdgeRecord]]:
+    cpg: nx.MultiDiGraph = nx.nx_agraph.read_dot(cpg_path)
+
+    def nodes():
+        for node in cpg.nodes:
+            yield int(node), dict(cpg.nodes[node])
+
+    def edges():
+        for head, tail, key, edge_dict in cpg.edges(data=True, keys=True):
+            yield int(head), int(tail), list(edge_dict.values())
+
+    return nodes(), edges()
+
+
+def _unwrap(value):
+    """
+    strip the GraphSON type wrappers, e.g. {"@type": "g:Int64", "@value": 1} -> 1
+    """
+    while isinstance(value, dict) and '@value' in value:
+        value = value['@value']
+    return value
+
+
+def _property_value(prop) -> str:
+    prop = _unwrap(prop)
+    if isinstance(prop, list):
+        values = [_property_value(item) for item in prop]
+        return values[0] if len(values) == 1 else ','.join(values)
+    if isinstance(prop, dict):
+        return _property_value(prop.get('value', ''))
+    if isinstance(prop, bool):
+        return str(prop).lower()
+    return str(prop)
+
+
+def read_graphson(cpg_path: str) -> tuple[Iterator[NodeRecord], Iterator[EdgeRecord]]:
+    """
+    read the GraphSON export of Joern (`joern-export --repr all --format graphson`) without networkx,
+    values are kept as strings, the same as in the dot export
+    """
+    with open(cpg_path, 'r') as cpg_file:
+        graph = _unwrap(json.load(cpg_file))
+
+    def nodes():
+        for vertex in graph.get('vertices', []):
+            vertex = _unwrap(vertex)
+            attr = {'label': vertex['label']}
+            for key, prop in vertex.get('properties', {}).items():
+                attr[key] = _property_value(prop)
+            yield int(_unwrap(vertex['id'])), attr
+
+    def edges():
+        for edge in graph.get('edges', []):
+            edge = _unwrap(edge)
+            attr = [edge['label']]
+            for prop in edge.get('properties', {}).values():
+                attr.append(_property_value(prop))
+            yield int(_unwrap(edge['outV'])), int(_unwrap(edge['inV'])), attr
+
+    return nodes(), edges()
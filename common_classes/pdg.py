@@ -1,57 +1,82 @@
+from __future__ import annotations
+
 from common_classes.pdg_node import PDGNode
 from common_classes.cpg_pdg_edge import Edge
+from joern_helper import lambda_formal_parameters
 import os
 import re
 import sys
 import networkx as nx
 
+# labels of the edges in the full cpg export, an edge property follows its label
+CPG_EDGE_LABELS = {'ALIAS_OF', 'ARGUMENT', 'AST', 'BINDS', 'BINDS_TO', 'CALL', 'CAPTURE', 'CAPTURED_BY', 'CDG', 'CFG',
+                   'CONDITION', 'CONTAINS', 'DOMINATE', 'EVAL_TYPE', 'IMPORTS', 'INHERITS_FROM', 'IS_CALL_FOR_IMPORT',
+                   'PARAMETER_LINK', 'POST_DOMINATE', 'REACHING_DEF', 'RECEIVER', 'REF', 'SOURCE_FILE', 'TAGGED_BY'}
+
 
 class PDG:
-    def __init__(self, pdg_path, cpg):
+    def __init__(self, pdg_path, cpg, nodes: list[tuple[int, dict]] = None,
+                 edges: list[tuple[int, int, list[str]]] = None):
+        """
+        :param pdg_path: dot file of the pdg, it is not read when nodes and edges are given
+        :param nodes: (node id, attributes), the method node comes first
+        :param edges: (head, tail, labels)
+        """
         self.pdg_path = pdg_path
         self.nodes: dict[int, PDGNode] = {}
         self.edges: dict[tuple[int, int], Edge] = {}
         self.out_edges: dict[int, list[int]] = {}
         self.in_edges: dict[int, list[int]] = {}
 
-        if not os.path.exists(self.pdg_path):
-            raise FileNotFoundError(f"dot file is not found in {self.pdg_path}")
+        # key: (head, tail), value: 'CFG' or 'DDG'
+        self.edge_types: dict[tuple[int, int], str] = {}
+
+        # key: node id, value: successors in the order of the behavior generation
+        self.ordered_successors: dict[int, tuple[int, ...]] = {}
 
-        pdg: nx.MultiDiGraph = nx.nx_agraph.read_dot(pdg_path)
+        if nodes is None:
+            if not os.path.exists(self.pdg_path):
+                raise FileNotFoundError(f"dot file is not found in {self.pdg_path}")
 
-        if len(pdg.nodes) == 0:
+            pdg: nx.MultiDiGraph = nx.nx_agraph.read_dot(pdg_path)
+            nodes = [(int(node), pdg.nodes[node]) for node in pdg.nodes]
+            edges = [(int(head), int(tail), list(edge_dict.values()))
+                     for head, tail, key, edge_dict in pdg.edges(data=True, keys=True)]
+
+        if len(nodes) == 0:
             return
+        node_attr = dict(nodes)
 
         # fist node in PDG
-        first_node_id = list(pdg.nodes)[0]
-        self.first_node_id = int(first_node_id)
+        first_node_id = nodes[0][0]
+        self.first_node_id = first_node_id
 
         # name of the pdg
-        self.name = pdg.nodes[first_node_id]['NAME']
+        self.name = node_attr[first_node_id]['NAME']
 
         # starting line number of the code corresponding to PDG
-        self.line_number = int(pdg.nodes[first_node_id]['LINE_NUMBER']) if 'LINE_NUMBER' in pdg.nodes[
+        self.line_number = int(node_attr[first_node_id]['LINE_NUMBER']) if 'LINE_NUMBER' in node_attr[
             first_node_id] else 0
 
         # ending line number of the code corresponding to PDG
-        self.line_number = int(pdg.nodes[first_node_id]['LINE_NUMBER_END']) if 'LINE_NUMBER_END' in pdg.nodes[
+        self.line_number = int(node_attr[first_node_id]['LINE_NUMBER_END']) if 'LINE_NUMBER_END' in node_attr[
             first_node_id] else 0
 
         # starting column number of the code corresponding to PDG
-        self.line_number = int(pdg.nodes[first_node_id]['COLUMN_NUMBER']) if 'COLUMN_NUMBER' in pdg.nodes[
+        self.line_number = int(node_attr[first_node_id]['COLUMN_NUMBER']) if 'COLUMN_NUMBER' in node_attr[
             first_node_id] else 0
 
         # ending column number of the code corresponding to PDG
-        self.line_number = int(pdg.nodes[first_node_id]['COLUMN_NUMBER_END']) if 'COLUMN_NUMBER_END' in pdg.nodes[
+        self.line_number = int(node_attr[first_node_id]['COLUMN_NUMBER_END']) if 'COLUMN_NUMBER_END' in node_attr[
             first_node_id] else 0
 
         # locate information about this method within the code file
-        if 'FULL_NAME' in pdg.nodes[first_node_id]:
-            self.full_name = pdg.nodes[first_node_id]['FULL_NAME']
+        if 'FULL_NAME' in node_attr[first_node_id]:
+            self.full_name = node_attr[first_node_id]['FULL_NAME']
         else:
             self.full_name = ''
-        if 'FILENAME' in pdg.nodes[first_node_id]:
-            self.file_name = pdg.nodes[first_node_id]['FILENAME']
+        if 'FILENAME' in node_attr[first_node_id]:
+            self.file_name = node_attr[first_node_id]['FILENAME']
         else:
             self.file_name = ''
         self.code = cpg.get_node(self.first_node_id).get_value('CODE')
@@ -69,30 +94,29 @@ class PDG:
             self.type = 'function'
 
         # read all nodes in pdg
-        for node in pdg.nodes:
-            node_id = int(node)
+        for node_id, attr in nodes:
             pdg_node = PDGNode(node_id)
             pdg_node.set_belong_to_pdg(self.first_node_id)
             pdg_node.set_file_path(self.file_name)
-            pdg_node.set_node_type(pdg.nodes[node]['NODE_TYPE'])
-            if 'LINE_NUMBER' in pdg.nodes[node]:
-                line_number = int(pdg.nodes[node]['LINE_NUMBER'])
+            pdg_node.set_node_type(attr['NODE_TYPE'])
+            if 'LINE_NUMBER' in attr:
+                line_number = int(attr['LINE_NUMBER'])
                 pdg_node.set_line_number(line_number)
             else:
                 pdg_node.set_line_number(sys.maxsize)
 
-            if 'COLUMN_NUMBER' in pdg.nodes[node]:
-                column_number = int(pdg.nodes[node]['COLUMN_NUMBER'])
+            if 'COLUMN_NUMBER' in attr:
+                column_number = int(attr['COLUMN_NUMBER'])
                 pdg_node.set_column_number(column_number)
             else:
                 pdg_node.set_column_number_end(sys.maxsize)
 
-            if 'NAME' in pdg.nodes[node]:
-                name = pdg.nodes[node]['NAME']
+            if 'NAME' in attr:
+                name = attr['NAME']
                 pdg_node.set_name(name)
 
-            if 'CODE' in pdg.nodes[node]:
-                code = cpg.get_node(int(node)).get_value('CODE')
+            if 'CODE' in attr:
+                code = cpg.get_node(node_id).get_value('CODE')
                 pdg_node.set_code(code)
 
             self.nodes[node_id] = pdg_node
@@ -101,9 +125,7 @@ class PDG:
         self.nodes[self.first_node_id].set_entrance(True)
 
         # read all edges in pdg
-        for head, tail, key, edge_dict in pdg.edges(data=True, keys=True):
-            src = int(head)
-            dst = int(tail)
+        for src, dst, edge_attr in edges:
             if src not in self.nodes:
                 continue
             if (src, dst) not in self.edges:
@@ -126,10 +148,90 @@ class PDG:
             else:
                 if src not in self.in_edges[dst]:
                     self.in_edges[dst].append(src)
-            for _key, _value in edge_dict.items():
+            for _value in edge_attr:
                 pdg_edge.set_attr(_value)
             self.edges[(src, dst)] = pdg_edge
 
+        # an edge with any data dependency is a DDG edge
+        for edge_id, pdg_edge in self.edges.items():
+            is_ddg = any('DDG' in attr for attr in pdg_edge.get_attr())
+            self.edge_types[edge_id] = 'DDG' if is_ddg else 'CFG'
+
+        # control flow successors in reverse, then data dependencies by line number
+        for src, tails in self.out_edges.items():
+            cfg_tails = [tail for tail in reversed(tails) if self.edge_types[(src, tail)] == 'CFG']
+            ddg_tails = sorted((tail for tail in tails if self.edge_types[(src, tail)] == 'DDG'),
+                               key=lambda tail: self.nodes[tail].get_line_number() if tail in self.nodes
+                               else sys.maxsize)
+            self.ordered_successors[src] = tuple(cfg_tails + ddg_tails)
+
+    @classmethod
+    def from_cpg(cls, cpg, method_id: int, package_dir: str) -> PDG:
+        """
+        derive the pdg of a method from the loaded cpg, the same view as joern_preprocess gives for the dot exports
+        :param method_id: id of the METHOD node
+        :param package_dir: source of the package, lambda parameters are read from it
+        """
+        method_node = cpg.get_node(method_id)
+        members = {method_id}
+        param_ids = []
+        return_ids = set()
+        for child in cpg.get_child_ast(method_id):
+            if child.get_value('label') == 'METHOD_PARAMETER_IN':
+                param_ids.append(child.get_id())
+            elif child.get_value('label') == 'METHOD_RETURN':
+                return_ids.add(child.get_id())
+        members.update(param_ids)
+        members.update(return_ids)
+
+        # control flow nodes of the method, unreachable code is only linked by CONTAINS
+        stack = [method_id]
+        for tail_id in cpg.get_successors(method_id):
+            if 'CONTAINS' in cpg.get_edge_attr(method_id, tail_id):
+                stack.append(tail_id)
+        while stack:
+            node_id = stack.pop()
+            for tail_id in cpg.get_successors(node_id):
+                if 'CFG' in cpg.get_edge_attr(node_id, tail_id):
+                    if node_id not in members:
+                        members.add(node_id)
+                    if tail_id not in members:
+                        members.add(tail_id)
+                        stack.append(tail_id)
+
+        # only the formal parameters of a lambda function depend on the method
+        dependent_param_ids = set(param_ids)
+        if param_ids and re.search(r'<lambda>\d*', method_node.get_value('NAME')):
+            formal_parameter_list = lambda_formal_parameters(package_dir, method_node.get_attr())
+            dependent_param_ids = {param_id for param_id in param_ids
+                                   if cpg.get_node(param_id).get_value('CODE') in formal_parameter_list}
+
+        ordered_ids = [method_id] + sorted(members - {method_id})
+        nodes = []
+        for node_id in ordered_ids:
+            attr = dict(cpg.get_node(node_id).get_attr())
+            attr['NODE_TYPE'] = attr['label']
+            if 'CODE' not in attr:
+                attr['CODE'] = ''
+            nodes.append((node_id, attr))
+
+        edges = []
+        for src in ordered_ids:
+            for dst in sorted(cpg.get_successors(src)):
+
+                # the in edges of METHOD_RETURN are removed as in joern_preprocess
+                if dst not in members or dst in return_ids:
+                    continue
+                labels = pdg_edge_labels(cpg.get_edge_attr(src, dst))
+                if src == method_id and dst in dependent_param_ids:
+                    labels.append('DDG')
+                if labels:
+                    edges.append((src, dst, labels))
+        for param_id in dependent_param_ids:
+            if param_id not in cpg.get_successors(method_id):
+                edges.append((method_id, param_id, ['DDG']))
+        return cls(pdg_path=None, cpg=cpg, nodes=nodes, edges=edges)
+
     def get_node(self, node_id) -> PDGNode:
         return self.nodes[node_id]
 
@@ -157,8 +259,35 @@ class PDG:
     def get_out_edges(self) -> dict[int, list[int]]:
         return self.out_edges
 
+    def get_edge_type(self, head: int, tail: int) -> str:
+        return self.edge_types[(head, tail)]
+
+    def get_ordered_successors(self, node_id: int) -> tuple[int, ...]:
+        return self.ordered_successors.get(node_id, ())
+
     def get_first_node_id(self) -> int:
         return self.first_node_id
 
     def get_full_name(self) -> str:
         return self.full_name
+
+
+def pdg_edge_labels(cpg_edge_attr: list[str]) -> list[str]:
+    """
+    pdg labels of a cpg edge: 'DDG: variable' for the data dependencies, otherwise 'CFG' for the control flow,
+    control dependencies and the data dependencies of 'this' are dropped
+    """
+    ddg_labels = []
+    for index, item in enumerate(cpg_edge_attr):
+        if item != 'REACHING_DEF':
+            continue
+        variable = ''
+        if index + 1 < len(cpg_edge_attr) and cpg_edge_attr[index + 1] not in CPG_EDGE_LABELS:
+            variable = cpg_edge_attr[index + 1]
+        if variable not in ['', 'this']:
+            ddg_labels.append(f"DDG: {variable}")
+    if ddg_labels:
+        return ddg_labels
+    if 'CFG' in cpg_edge_attr:
+        return ['CFG']
+    return []
@@ -1,3 +1,5 @@
+from __future__ import annotations
+
 import json
 import os
 
@@ -67,6 +69,23 @@ class Report:
         else:
             return False
 
+    def merge(self, report: Report):
+        """
+        add the behaviors of another report, e.g. of a run-time worker,
+        duplicates are dropped as in add_malicious_locality
+        """
+        if report.get_malicious():
+            self.set_malicious(True)
+        self.install_time_script.update(report.install_time_script)
+        for phase, behavior_dict in [('INSTALL', report.install_time_mal_behavior),
+                                     ('IMPORT', report.import_time_mal_behavior),
+                                     ('RUN TIME', report.run_time_mal_behavior)]:
+            for description, matches in behavior_dict.items():
+                for one_match in matches:
+                    locality = [(filename, line_number) for filename, line_numbers in one_match['file'].items()
+                                for line_number in line_numbers]
+                    self.add_malicious_locality(phase, description, one_match['pattern desc'], locality)
+
     def write_to_file(self, path: str):
         path = os.path.join(path, 'report.json')
         data = {'Malicious': self.is_malicious}
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import pickle
 from common_classes.pdg_node import PDGNode
@@ -9,9 +10,10 @@ from common_classes.pattern import Pattern
 from common_classes.report import Report
 from category import category_doc
 import llm
+import rule_engine
 import re
 import shutil
-from ast_parser import ASTParser
+from ast_parser import ASTCache
 from common_classes.cpg import CPG
 from common_classes.pdg import PDG
 from common_classes.cpg_pdg_edge import Edge
@@ -29,8 +31,43 @@ class PatternList:
     def get_pattern_list(self):
         return self.pattern_list
 
+# pattern description: (class of the node whose arguments are checked, indicators of rule_engine,
+# llm judgement of the arguments that the indicators do not decide)
+FURTHER_ANALYSIS = {
+    'execute a command': ('execute a command', 'command', llm.llm_execute_command_analysis_async),
+    'run an executable file': ('run an executable file', 'executable', llm.llm_run_executable_file_async),
+    'read from file - execute dynamically created program':
+        ('read data from a file', 'read_file', llm.llm_read_file_command_analysis_async),
+    'manipulate path - read local file - send through network communication':
+        ('read data from a file', 'read_file', llm.llm_read_file_command_analysis_async),
+    'read local file - send through network communication':
+        ('read data from a file', 'read_file', llm.llm_read_file_command_analysis_async),
+    'read local file - send through HTTP request':
+        ('read data from a file', 'read_file', llm.llm_read_file_command_analysis_async),
+    'search file - send through network': ('search for a file', 'read_file', llm.llm_read_file_command_analysis_async),
+    'spawn a new process': ('spawn a new process', 'command', llm.llm_execute_command_analysis_async),
+    'execute a dynamically created program':
+        ('execute a dynamically created program', 'program', llm.llm_dynamically_created_program_analysis_async),
+    'make HTTP request - write data to local sensitive path':
+        ('write data to a file', 'write_file', llm.llm_write_file_command_analysis_async),
+    'change file mode - write data to file':
+        ('write data to a file', 'write_file', llm.llm_write_file_command_analysis_async),
+    'read file - write data to file': ('write data to a file', 'write_file', llm.llm_write_file_command_analysis_async),
+    'encode data - data rep - send through network communication':
+        ('create a network server or communication', 'url', llm.llm_suspicious_url_async),
+    'encode data - send through network communication':
+        ('create a network server or communication', 'url', llm.llm_suspicious_url_async),
+}
+
+# patterns that are not reported once the package steals information
+INFORMATION_STEALING_EXCLUDED = {
+    'encode data - data rep - send through network communication',
+    'encode data - send through network communication',
+}
+
+
 class Result:
-    def __init__(self, cpg: CPG, pdg_dict: dict[int, PDG], package_dir, package_name):
+    def __init__(self, cpg: CPG, pdg_dict: dict[int, PDG], package_dir, package_name, ast_cache: ASTCache = None):
         self.entrance_node = None  # entrance of the Result
         self.return_node: list[PDGNode] = []  # return value of the result
         self.nodes: dict[int, PDGNode] = {}
@@ -47,141 +84,36 @@ class Result:
         self.pdg_dict = pdg_dict
         self.package_dir = package_dir
         self.package_name = package_name
+        self.ast_cache = ast_cache if ast_cache is not None else ASTCache()  # parsed source files
 
     def pattern_further_analysis(self, pattern: Pattern, one_match: dict):
+        judgement = self.further_analysis_request(pattern, one_match)
+        if asyncio.iscoroutine(judgement):
+            return llm.run(judgement)
+        return judgement
 
-        # further analysis
-        if pattern.get_pattern_desc() == 'execute a command':
-            command_node_id = one_match['execute a command'][0]
-            execute_command_string = self.parameter_fetch(command_node_id)
-            if execute_command_string is None:
-                return True
-            if execute_command_string != '':
-                # judge whether the command is malicious or not
-                if llm.llm_execute_command_analysis(execute_command_string):
-                    return True
-                else:
-                    return False
-            else:
-
-                return False
-        elif pattern.get_pattern_desc() == 'run an executable file':
-            run_file_node_id = one_match['run an executable file'][0]
-            file_path = self.parameter_fetch(run_file_node_id)
-            if file_path is None:
-                return True
-            if file_path != '':
-                if llm.llm_run_executable_file(file_path):
-                    return True
-                else:
-                    return False
-            else:
-                return False
-        elif pattern.get_pattern_desc() == 'read from file - execute dynamically created program' \
-                or pattern.get_pattern_desc() == 'manipulate path - read local file - send through network communication' \
-                or pattern.get_pattern_desc() == 'read local file - send through network communication' \
-                or pattern.get_pattern_desc() == 'read local file - send through HTTP request':
-
-            read_file_node_id = one_match['read data from a file'][0]
-            file_path = self.parameter_fetch(read_file_node_id)
-            if file_path is None:
-                return True
-            if file_path != '':
-                # judge whether the command read sensitive files
-                if llm.llm_read_file_command_analysis(file_path):
-                    return True
-                else:
-                    return False
-            else:
-                return False
-
-        elif pattern.get_pattern_desc() == 'search file - send through network':
-
-            search_file_node_id = one_match['search for a file'][0]
-            file_path = self.parameter_fetch(search_file_node_id)
-            if file_path is None:
-                return True
-            if file_path != '':
-                if llm.llm_read_file_command_analysis(file_path):
-                    return True
-                else:
-                    return False
-            else:
-                return False
-
-        elif pattern.get_pattern_desc() == 'spawn a new process':
-
-            spawn_new_process_node_id = one_match['spawn a new process'][0]
-            process_string = self.parameter_fetch(spawn_new_process_node_id)
-            if process_string is None:
-                return True
-            if process_string != '':
-                # judge whether the command
-                if llm.llm_execute_command_analysis(process_string):
-                    return True
-                else:
-                    return False
-            else:
-                return False
-        elif pattern.get_pattern_desc() == 'execute a dynamically created program':
-
-            # execute a dynamically created program
-            dynamically_created_program = one_match['execute a dynamically created program'][0]
-            function_string = self.parameter_fetch(dynamically_created_program)
-            if function_string is None:
-                return True
-            if function_string != '':
-                # judge the code executed
-                if llm.llm_dynamically_created_program_analysis(function_string):
-                    return True
-                else:
-                    return False
-            else:
-                return False
-
-        elif pattern.get_pattern_desc() == 'make HTTP request - write data to local sensitive path' \
-                or pattern.get_pattern_desc() == 'change file mode - write data to file' \
-                or pattern.get_pattern_desc() == 'read file - write data to file':
-
-            write_file_node_id = one_match['write data to a file'][0]
-            file_path = self.parameter_fetch(write_file_node_id)
-            if file_path is None:
-                return True
-            if file_path != '':
-                if llm.llm_write_file_command_analysis(file_path):
-                    return True
-                else:
-                    return False
-            else:
-                return False
-        elif pattern.get_pattern_desc() == 'encode data - data rep - send through network communication' \
-                or pattern.get_pattern_desc() == 'encode data - send through network communication':
-            if self.package_report.contain_information_stealing():
-                return False
-            network_communication_node_id = one_match['create a network server or communication'][0]
-            network_options = self.parameter_fetch(network_communication_node_id)
-            if network_options is None:
-                return True
-            if network_options != '':
-
-                if llm.llm_suspicious_url(network_options):
-                    return True
-                else:
-                    return False
-            else:
-                return False
-        else:
+    def further_analysis_request(self, pattern: Pattern, one_match: dict):
+        """
+        fetch the arguments of the node to check and judge them by the indicators of rule_engine
+        :return: the judgement if no llm is needed, otherwise the coroutine of the llm judgement
+        """
+        if pattern.get_pattern_desc() not in FURTHER_ANALYSIS:
             return True
+        if pattern.get_pattern_desc() in INFORMATION_STEALING_EXCLUDED and \
+                self.package_report.contain_information_stealing():
+            return False
+        node_class, indicator_kind, llm_judgement = FURTHER_ANALYSIS[pattern.get_pattern_desc()]
+        argument_string = self.parameter_fetch(one_match[node_class][0])
+        if argument_string is None:
+            return True
+        if argument_string == '':
+            return False
 
-    @staticmethod
-    def extract_code(file_path, start_line, start_column):
-        with open(file_path, 'r') as file:
-            lines = file.readlines()
-        extracted_code = []
-        extracted_code.append(lines[start_line - 1][start_column:])
-        extracted_code.extend(lines[start_line:])
-
-        return ''.join(extracted_code)
+        # the obvious cases are decided by the local indicators, only the others are sent to the llm
+        rule_verdict = rule_engine.verdict(indicator_kind, argument_string)
+        if rule_verdict is not None:
+            return rule_verdict
+        return llm_judgement(argument_string)
 
     def parameter_fetch(self, function_id):
         function_pdg_node = self.nodes[function_id]  # get the corresponding pdg
@@ -189,7 +121,6 @@ class Result:
         column_number = function_pdg_node.get_column_number()  # column number
         argument_identifier_list = []
         code_path = os.path.join(self.package_dir, function_pdg_node.get_file_name())
-        part_code = self.extract_code(code_path, line_number, column_number)
 
         # tree-sitter query
         new_argument_query = """
@@ -216,7 +147,7 @@ class Result:
 	                                            arguments:(arguments)@arguments
                                             )
         """
-        parser = ASTParser(part_code, 'javascript')
+        parser = self.ast_cache.parse_from(code_path, line_number, column_number)
         new_expression_arguments = parser.query_oneshot(new_argument_query)
         require_expression_arguments = parser.query(require_expression_argument_query)
         arguments = parser.query_oneshot(arguments_query)
@@ -257,9 +188,7 @@ class Result:
             column_number = function_pdg_node.get_column_number()
 
             # insert based on the ast
-            with open(code_path, 'r') as code_file:
-                code = code_file.read()
-            ast_parser = ASTParser(code, 'javascript')
+            ast_parser = self.ast_cache.parse_file(code_path)
             expression_statement_position = ast_parser.get_first_expression(line_number=line_number - 1,
                                                                             column_number=column_number)
             if expression_statement_position is None:
@@ -518,6 +447,7 @@ class Result:
         if len(self.sensitive_behavior.get_nodes()) == 0:
             return None
         matched_pattern = []  # already matched pattern
+        matches = []  # (pattern, match, judgement or coroutine of the llm judgement)
         for pattern in mal_pattern_list:
 
             head_of_kpr = pattern.get_head_of_kpr()
@@ -540,15 +470,28 @@ class Result:
                         for one_match in matched_node_list:
 
                             # in the offline phase, annotate this code
-                            further_analysis_result = self.pattern_further_analysis(pattern, one_match)
-                            if further_analysis_result:
-                                file_and_line = self.line_number_file_location(one_match, pattern)
-                                self.package_report.add_malicious_locality(phase,
-                                                                           pattern.get_maliciousness(),
-                                                                           pattern.get_pattern_desc(),
-                                                                           file_and_line)
-
-                                self.package_report.set_malicious(True)
+                            matches.append((pattern, one_match, self.further_analysis_request(pattern, one_match)))
+
+        # the llm judgements of all the matches are requested at once
+        pending = [index for index, match in enumerate(matches) if asyncio.iscoroutine(match[2])]
+        answers = llm.gather([matches[index][2] for index in pending])
+        judgements = [match[2] for match in matches]
+        for index, answer in zip(pending, answers):
+            judgements[index] = answer
+
+        for (pattern, one_match, _), further_analysis_result in zip(matches, judgements):
+            # an earlier match of this behavior may have been information stealing
+            if pattern.get_pattern_desc() in INFORMATION_STEALING_EXCLUDED and \
+                    self.package_report.contain_information_stealing():
+                continue
+            if further_analysis_result:
+                file_and_line = self.line_number_file_location(one_match, pattern)
+                self.package_report.add_malicious_locality(phase,
+                                                           pattern.get_maliciousness(),
+                                                           pattern.get_pattern_desc(),
+                                                           file_and_line)
+
+                self.package_report.set_malicious(True)
 
     @staticmethod
     def is_in_matched_pattern_list(pattern: Pattern, matched_pattern: list[Pattern]):
@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+
+# layout: header, buffer table, pickled fingerprint, pickle payload, out-of-band buffers aligned to BUFFER_ALIGNMENT
+SNAPSHOT_MAGIC = b'SPDRSNAP'
+SNAPSHOT_VERSION = 2
+HEADER = struct.Struct('<8sIQQQ')  # magic, version, fingerprint length, payload length, number of buffers
+BUFFER_ENTRY = struct.Struct('<QQ')  # offset, length
+BUFFER_ALIGNMENT = 64
+
+
+def source_fingerprint(paths: list[str], options: dict = None) -> dict:
+    """
+    mtime and size of every source, a snapshot is stale if any of them changed
+    :param options: settings that change the loaded graphs, e.g. the cpg backend
+    """
+    fingerprint = {'version': SNAPSHOT_VERSION, 'options': options or {}}
+    for path in paths:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            fingerprint[path] = (stat.st_mtime_ns, stat.st_size)
+        else:
+            fingerprint[path] = None
+    return fingerprint
+
+
+def write_snapshot(snapshot_path: str, data, fingerprint: dict):
+    """
+    pickle (protocol 5) data with its fingerprint, large buffers such as numpy arrays are stored out of band
+    so that they are mapped instead of copied when the snapshot is read
+    """
+    buffers = []
+    fingerprint_payload = pickle.dumps(fingerprint, protocol=5)
+    payload = pickle.dumps(data, protocol=5, buffer_callback=buffers.append)
+    raw_buffers = [buffer.raw() for buffer in buffers]
+
+    offset = HEADER.size + BUFFER_ENTRY.size * len(raw_buffers) + len(fingerprint_payload) + len(payload)
+    table = []
+    for raw in raw_buffers:
+        offset += -offset % BUFFER_ALIGNMENT
+        table.append((offset, raw.nbytes))
+        offset += raw.nbytes
+
+    # write aside and rename, a reader never sees a partial snapshot
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(snapshot_path), prefix='.snapshot-')
+    try:
+        with os.fdopen(fd, 'wb') as snapshot_file:
+            snapshot_file.write(HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(fingerprint_payload), len(payload),
+                                            len(raw_buffers)))
+            for entry in table:
+                snapshot_file.write(BUFFER_ENTRY.pack(*entry))
+            snapshot_file.write(fingerprint_payload)
+            snapshot_file.write(payload)
+            for (buffer_offset, _), raw in zip(table, raw_buffers):
+                snapshot_file.write(b'\0' * (buffer_offset - snapshot_file.tell()))
+                snapshot_file.write(raw)
+        os.replace(tmp_path, snapshot_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def read_snapshot(snapshot_path: str, fingerprint: dict):
+    """
+    :return: the data of the snapshot, None if it is missing, of another version or stale
+    """
+    if not os.path.exists(snapshot_path):
+        return None
+    with open(snapshot_path, 'rb') as snapshot_file:
+        try:
+            mapped = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return None
+    if len(mapped) < HEADER.size:
+        return None
+    magic, version, fingerprint_length, payload_length, buffer_number = HEADER.unpack_from(mapped, 0)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        return None
+    view = memoryview(mapped)
+    fingerprint_offset = HEADER.size + BUFFER_ENTRY.size * buffer_number
+    payload_offset = fingerprint_offset + fingerprint_length
+    try:
+        if pickle.loads(view[fingerprint_offset:payload_offset]) != fingerprint:
+            return None
+
+        # out-of-band buffers stay views of the mapped file
+        buffers = []
+        for index in range(buffer_number):
+            buffer_offset, buffer_length = BUFFER_ENTRY.unpack_from(mapped, HEADER.size + BUFFER_ENTRY.size * index)
+            buffers.append(view[buffer_offset:buffer_offset + buffer_length])
+        return pickle.loads(view[payload_offset:payload_offset + payload_length], buffers=buffers)
+    except (pickle.UnpicklingError, EOFError, AttributeError, ImportError, ValueError, struct.error):
+        return None
@@ -0,0 +1,64 @@
+import os
+import csv
+import sqlite3
+import argparse
+import db_instance
+
+# columns of the api tables, the code column of a third-part table holds the source of the function
+API_COLUMNS = ['id', 'package', 'file', 'name', 'qualifiedname', 'comment', 'parameters_num', 'category', 'summary']
+COLUMN_TYPES = {'id': 'INTEGER PRIMARY KEY', 'parameters_num': 'INTEGER'}
+
+
+def create_tables(connection: sqlite3.Connection, ecosystem: str):
+    """
+    create the builtin, third and code tables of an ecosystem with the indexes of the lookups
+    """
+    tables = {
+        f'{ecosystem}_builtin': API_COLUMNS,
+        f'{ecosystem}_third': API_COLUMNS + ['code'],
+        f'{ecosystem}_code': ['id', 'code', 'category', 'summary'],
+    }
+    for table, columns in tables.items():
+        definitions = ', '.join(f"{column} {COLUMN_TYPES.get(column, 'TEXT')}" for column in columns)
+        connection.execute(f"CREATE TABLE IF NOT EXISTS {table} ({definitions})")
+        if 'package' in columns:
+            connection.execute(f"CREATE INDEX IF NOT EXISTS {table}_package_name ON {table} (package, name)")
+
+
+def import_csv(connection: sqlite3.Connection, csv_path: str, table: str, replace: bool = False) -> int:
+    """
+    import a csv file into a table, the header of the file names the columns
+    :param csv_path: csv file, e.g. csv/npm_builtin.csv
+    :param table: table name, e.g. npm_builtin
+    :param replace: delete the rows of the table first
+    :return: number of imported rows
+    """
+    csv.field_size_limit(2 ** 31 - 1)
+    with open(csv_path, 'r', newline='', encoding='utf-8') as csv_file:
+        reader = csv.reader(csv_file)
+        header = next(reader)
+        rows = [[value if value != '' else None for value in row] for row in reader]
+    with connection:
+        if replace:
+            connection.execute(f"DELETE FROM {table}")
+        placeholders = ', '.join('?' * len(header))
+        connection.executemany(f"INSERT OR REPLACE INTO {table} ({', '.join(header)}) VALUES ({placeholders})", rows)
+    return len(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-csv_dir', type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'csv'))
+    parser.add_argument('-db', type=str, default=db_instance.sqlite_path)
+    parser.add_argument('-ecosystem', type=str, default='npm')
+    parser.add_argument('-replace', action='store_true')
+    args = parser.parse_args()
+
+    _connection = sqlite3.connect(args.db)
+    create_tables(_connection, args.ecosystem)
+    for _cat in ['builtin', 'third', 'code']:
+        _table = f'{args.ecosystem}_{_cat}'
+        _csv_path = os.path.join(args.csv_dir, f'{_table}.csv')
+        if os.path.exists(_csv_path):
+            print(f"{_table}: {import_csv(_connection, _csv_path, _table, args.replace)} rows")
+    _connection.close()
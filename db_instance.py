@@ -1,4 +1,9 @@
-import pymysql
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
 
 # For ease of deployment and data constraints, we provide data in CSV format. You can create tables based on your local database engine and set the corresponding connection parameters
 host = ''
@@ -7,48 +12,213 @@ db = ''
 user = ''
 password = ''
 
+# mysql, or sqlite for a local database file built from the csv folder by csv2sqlite.py
+backend = 'mysql'
+sqlite_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'csv', 'api.sqlite')
+
+# idle connections kept per process, a closed DatabaseConnection gives its connection back to the pool
+pool_size = 4
+
+
+def use_sqlite(path: str = None):
+    """
+    connect to a local SQLite database instead of the MySQL server
+    :param path: the database file, default is csv/api.sqlite
+    """
+    global backend, sqlite_path
+    backend = 'sqlite'
+    if path is not None:
+        sqlite_path = path
+
+
+class ConnectionPool:
+    """
+    idle connections of one database, a connection is used by one DatabaseConnection at a time
+    """
+
+    def __init__(self, backend_name: str):
+        self.backend = backend_name
+        self.idle: queue.LifoQueue = queue.LifoQueue()
+
+    def connect(self):
+        if self.backend == 'sqlite':
+            if not os.path.exists(sqlite_path):
+                raise FileNotFoundError(f"SQLite database {sqlite_path} not found, create it with csv2sqlite.py")
+            # the batch workers share the file, a writer waits for the lock of another one
+            return sqlite3.connect(sqlite_path, timeout=60, check_same_thread=False, cached_statements=256)
+        import pymysql
+        return pymysql.connect(host=host, port=port, db=db, user=user, password=password)
+
+    def acquire(self):
+        while True:
+            try:
+                connection = self.idle.get_nowait()
+            except queue.Empty:
+                return self.connect()
+            try:
+                if self.backend == 'mysql':
+                    # the server drops connections idle for longer than its wait_timeout
+                    connection.ping(reconnect=True)
+                return connection
+            except Exception:
+                continue
+
+    def release(self, connection):
+        try:
+            connection.rollback()
+        except Exception:
+            return
+        if self.idle.qsize() < pool_size:
+            self.idle.put(connection)
+        else:
+            connection.close()
+
+
+_pools: dict[tuple, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    key = (backend, sqlite_path) if backend == 'sqlite' else (backend, host, port, db, user)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(backend)
+        return _pools[key]
+
+
+def _after_fork_in_child():
+    # the child must not share the sockets of its parent
+    global _pools_lock
+    _pools.clear()
+    _pools_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+@lru_cache(maxsize=512)
+def prepare(placeholder: str, action: str, table: str, columns: tuple = (), where: tuple = ()) -> str:
+    """
+    build a statement once, the same text is reused by every call, so that the driver can reuse its parsed form
+    :param action: select, insert or update
+    :param columns: inserted or updated columns
+    :param where: columns of the equality conditions joined with AND
+    """
+    if action == 'select':
+        statement = f"SELECT * FROM {table}"
+    elif action == 'insert':
+        values = ', '.join([placeholder] * len(columns))
+        statement = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({values})"
+    elif action == 'update':
+        statement = f"UPDATE {table} SET " + ', '.join(f"{column} = {placeholder}" for column in columns)
+    else:
+        raise ValueError(f"Unknown action {action}")
+    if where:
+        statement += " WHERE " + " AND ".join(f"{column} = {placeholder}" for column in where)
+    return statement
+
 
 class DatabaseConnection:
     def __init__(self, loc: str):
         self.loc = loc
-        self.placeholder = '%s'
-        self._connection = pymysql.connect(host=host, port=port, db=db, user=user, password=password)
+        self._pool = get_pool()
+        self.placeholder = '?' if self._pool.backend == 'sqlite' else '%s'
+        self._connection = self._pool.acquire()
+        self._cursor = self._connection.cursor()
+        self._transaction_depth = 0
 
     def close(self):
+        """
+        give the connection back to the pool
+        """
         if self._connection:
-            self._connection.close()
+            self._cursor.close()
+            self._pool.release(self._connection)
+            self._connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @contextmanager
+    def transaction(self):
+        """
+        the writes in the block are committed together, or rolled back on an exception
+        """
+        self._transaction_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._transaction_depth -= 1
+            if self._transaction_depth == 0:
+                self._connection.rollback()
+            raise
+        self._transaction_depth -= 1
+        if self._transaction_depth == 0:
+            self._connection.commit()
+
+    def commit(self):
+        # a write inside a transaction is committed at the end of the transaction
+        if self._transaction_depth == 0:
+            self._connection.commit()
+
+    def execute(self, statement, args=()):
+        self._cursor.execute(statement, args)
+        return self._cursor
+
+    def executemany(self, statement, rows):
+        self._cursor.executemany(statement, rows)
+        self.commit()
 
     def test(self):
-        cursor = self._connection.cursor()
-        query = "SELECT * FROM npm_builtin WHERE package = %s"
-        args = 'os'
-        cursor.execute(query, (args,))
-        res = cursor.fetchall()
+        res = self.execute(prepare(self.placeholder, 'select', 'npm_builtin', where=('package',)), ('os',)).fetchall()
         print(res)
 
-    def package_in_builtin(self, package, eco):
+    def table(self, ecosystem, cat):
         """
-        whether the given package in builtin
+        all rows of a table
+        :return: column names, rows
         """
-        cursor = self._connection.cursor()
-        query = f"""
-            SELECT * FROM {eco}_builtin WHERE package = {self.placeholder}
+        cursor = self.execute(prepare(self.placeholder, 'select', f"{ecosystem}_{cat}"))
+        rows = cursor.fetchall()
+        return [description[0] for description in cursor.description], rows
+
+    def uncategorised(self, ecosystem, cat):
         """
-        cursor.execute(query, package)
+        rows without category
+        :return: column names, rows
+        """
+        cursor = self.execute(f"SELECT * FROM {ecosystem}_{cat} WHERE category IS NULL OR category = ''")
         rows = cursor.fetchall()
-        return rows
+        return [description[0] for description in cursor.description], rows
+
+    def columns(self, ecosystem, cat):
+        cursor = self.execute(f"SELECT * FROM {ecosystem}_{cat} LIMIT 0")
+        cursor.fetchall()
+        return [description[0] for description in cursor.description]
+
+    def packages(self, ecosystem, cat):
+        """
+        distinct packages of a table
+        """
+        return [row[0] for row in self.execute(f"SELECT DISTINCT package FROM {ecosystem}_{cat}").fetchall()]
+
+    def package_in_builtin(self, package, eco):
+        """
+        whether the given package in builtin
+        """
+        return self.execute(prepare(self.placeholder, 'select', f"{eco}_builtin", where=('package',)),
+                            (package,)).fetchall()
 
     def package_in_third_part(self, package, eco):
         """
         whether the given package is third-part
         """
-        cursor = self._connection.cursor()
-        query = f"""
-            SELECT * FROM {eco}_third WHERE package = {self.placeholder}
-        """
-        cursor.execute(query, package)
-        rows = cursor.fetchall()
-        return rows
+        return self.execute(prepare(self.placeholder, 'select', f"{eco}_third", where=('package',)),
+                            (package,)).fetchall()
 
     def query(self, ecosystem, cat, *args):
         """
@@ -58,32 +228,13 @@ class DatabaseConnection:
         :param args: varied parameters
         :return: query rows
         """
-        cursor = self._connection.cursor()
-        query_command = f"""
-            SELECT * FROM {ecosystem}_{cat} WHERE 
-        """
-
         # Checking the number of provided parameters
         if len(args) % 2 != 0:
             raise ValueError("Invalid number of parameters. Each column must have a corresponding value.")
 
-        # Constructing the conditions based on parameters
-        conditions = []
-        value_list = []
-        for i in range(0, len(args), 2):
-            column = args[i]
-            value = args[i + 1]
-            conditions.append(f"""{column} = {self.placeholder} """)
-            value_list.append(value)
-
-        # Joining the conditions with 'AND'
-        query_command += " AND ".join(conditions)
-        if len(value_list) == 1:
-            cursor.execute(query_command, (value_list[0]))
-        else:
-            cursor.execute(query_command, (value_list[0], value_list[1]))
-        rows = cursor.fetchall()
-        return rows
+        # the conditions are joined with 'AND'
+        statement = prepare(self.placeholder, 'select', f"{ecosystem}_{cat}", where=tuple(args[0::2]))
+        return self.execute(statement, tuple(args[1::2])).fetchall()
 
     def update(self, ecosystem, cat, id, column_name, value):
         """
@@ -94,25 +245,23 @@ class DatabaseConnection:
         :param column_name:
         :param value:
         """
+        self.execute(prepare(self.placeholder, 'update', f"{ecosystem}_{cat}", (column_name,), ('id',)), (value, id))
+        self.commit()
 
-        cursor = self._connection.cursor()
-        update_query = f"""
-            UPDATE  {ecosystem}_{cat}
-            SET {column_name} = {self.placeholder}
-            WHERE id = {self.placeholder} 
+    def update_many(self, ecosystem, cat, column_name, values):
         """
-        cursor.execute(update_query, (value, id))
-        self._connection.commit()
+        update one column of many rows in one statement
+        :param values: (id, value) pairs
+        """
+        statement = prepare(self.placeholder, 'update', f"{ecosystem}_{cat}", (column_name,), ('id',))
+        self.executemany(statement, [(value, id) for id, value in values])
 
     def insert(self, ecosystem, cat, qualifier, name, qualifiedname, category, summary):
-        cursor = self._connection.cursor()
-        insert_query = f'''
-                INSERT INTO {ecosystem}_{cat} (package, name, qualifiedname, category, summary)
-                VALUES ({self.placeholder}, {self.placeholder}, {self.placeholder}, {self.placeholder}, {self.placeholder})
-            '''
-        data = (qualifier, name, qualifiedname, category, summary)
-        cursor.execute(insert_query, data)
-        self._connection.commit()
+        statement = prepare(self.placeholder, 'insert', f"{ecosystem}_{cat}",
+                            ('package', 'name', 'qualifiedname', 'category', 'summary'))
+        cursor = self.execute(statement, (qualifier, name, qualifiedname, category, summary))
+        self.commit()
+        return cursor.lastrowid
 
     def insert_code(self, ecosystem, code, category, summary):
         """
@@ -122,40 +271,26 @@ class DatabaseConnection:
         :param category: category
         :param summary: summary
         """
-        cursor = self._connection.cursor()
-        insert_query = f'''
-            INSERT INTO {ecosystem}_code (code, category, summary)
-            VALUES ({self.placeholder}, {self.placeholder}, {self.placeholder})
-        '''
-
-        data = (code, category, summary)
-        cursor.execute(insert_query, data)
-        self._connection.commit()
+        self.execute(prepare(self.placeholder, 'insert', f"{ecosystem}_code", ('code', 'category', 'summary')),
+                     (code, category, summary))
+        self.commit()
 
     def to_db(self, package, file, name, qualifiedname, comment, parameters_num, code, table_name):
-        cursor = self._connection.cursor()
-        cursor.execute(
-            f"""
-            INSERT INTO {table_name}(package, file, name, qualifiedname, comment, parameters_num, code)
-            VALUES ({self.placeholder}, {self.placeholder}, {self.placeholder}, {self.placeholder}, {self.placeholder}, {self.placeholder}, {self.placeholder})
-        """,
-            (
-                package,
-                file,
-                name,
-                qualifiedname,
-                comment,
-                parameters_num,
-                code
-            ),
-        )
-        self._connection.commit()
+        statement = prepare(self.placeholder, 'insert', table_name,
+                            ('package', 'file', 'name', 'qualifiedname', 'comment', 'parameters_num', 'code'))
+        cursor = self.execute(statement, (package, file, name, qualifiedname, comment, parameters_num, code))
+        self.commit()
+        return cursor.lastrowid
 
-    def function_of_the_module(self, ecosystem, package, function, cat):
-        cursor = self._connection.cursor()
-        query = f"""
-            SELECT * FROM {ecosystem}_{cat} WHERE package = {self.placeholder} and name = {self.placeholder}
+    def to_db_many(self, rows, table_name):
         """
-        cursor.execute(query, (package, function))
-        rows = cursor.fetchall()
-        return rows
+        insert many functions in one statement
+        :param rows: (package, file, name, qualifiedname, comment, parameters_num, code) tuples
+        """
+        statement = prepare(self.placeholder, 'insert', table_name,
+                            ('package', 'file', 'name', 'qualifiedname', 'comment', 'parameters_num', 'code'))
+        self.executemany(statement, rows)
+
+    def function_of_the_module(self, ecosystem, package, function, cat):
+        return self.execute(prepare(self.placeholder, 'select', f"{ecosystem}_{cat}", where=('package', 'name')),
+                            (package, function)).fetchall()
@@ -1,12 +1,202 @@
+from __future__ import annotations
+
+import atexit
+import fcntl
+import json
 import os
+import shutil
 import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+import requests
 import networkx as nx
 import re
 from ast_parser import ASTParser
+from common_classes import cpg_reader
+from common_classes.cpg import CPG
+from common_classes.cpg_reader import CPG_FILES
+
+# script run by the Joern server for one package, it produces the same layout as joern-parse + joern-export,
+# the project is closed even if the export fails, so that the workspace of the server does not grow
+EXPORT_SCRIPT = """
+try {{
+importCode(inputPath = {code_path}, projectName = {project}, language = {language})
+run.ossdataflow
+{method_export}
+overflowdb.formats.{exporter}.runExport(cpg.graph, java.nio.file.Files.createDirectories(java.nio.file.Paths.get({cpg_dir})))
+}} finally {{
+scala.util.Try(delete({project}))
+}}
+"""
+
+# per-method pdg and cfg, skipped when the pdgs are derived from the cpg
+METHOD_EXPORT_SCRIPT = """
+val pdgDir = java.nio.file.Files.createDirectories(java.nio.file.Paths.get({pdg_dir}))
+val cfgDir = java.nio.file.Files.createDirectories(java.nio.file.Paths.get({cfg_dir}))
+cpg.method.zipWithIndex.foreach {{ case (method, i) =>
+  java.nio.file.Files.writeString(pdgDir.resolve(s"$i-pdg.dot"), method.dotPdg.head)
+  java.nio.file.Files.writeString(cfgDir.resolve(s"$i-cfg.dot"), method.dotCfg.head)
+}}
+"""
+
+
+class JoernServerError(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+    def __str__(self):
+        return self.msg
+
+
+class JoernServer:
+    """
+    a long-lived Joern (`joern --server`) that keeps the JVM warm between packages
+    """
+
+    def __init__(self, host: str = 'localhost', port: int = 8080, spawn: bool = False, startup_timeout: int = 120):
+        self.host = host
+        self.port = port
+        self.url = f"http://{host}:{port}"
+        self.process = None
+
+        # the server runs one script at a time, the lock file is shared by the workers of every process
+        self.lock_path = os.path.join(tempfile.gettempdir(), f"joern-server-{host}-{port}.lock")
+        if spawn:
+            self.start(startup_timeout)
+
+    @contextmanager
+    def locked(self, blocking: bool = True):
+        """
+        hold the server for one export
+        :param blocking: wait for the server, otherwise yield False if another worker holds it
+        """
+        with open(self.lock_path, 'w') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def start(self, startup_timeout: int):
+        self.process = subprocess.Popen(['joern', '--server', '--server-host', self.host,
+                                         '--server-port', str(self.port)],
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        atexit.register(self.stop)
+        deadline = time.time() + startup_timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise JoernServerError(f"Joern server exited with code {self.process.returncode}")
+            if self.is_alive():
+                return
+            time.sleep(1)
+        self.stop()
+        raise JoernServerError(f"Joern server is not ready after {startup_timeout} seconds")
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+
+    def is_alive(self) -> bool:
+        try:
+            self.query('1', timeout=5)
+            return True
+        except (requests.RequestException, JoernServerError):
+            return False
+
+    def query(self, script: str, timeout: int) -> str:
+        response = requests.post(f"{self.url}/query-sync", json={'query': script}, timeout=timeout)
+        response.raise_for_status()
+        result = response.json()
+        if not result.get('success', False):
+            raise JoernServerError(f"Joern query failed: {result.get('stderr') or result.get('stdout')}")
+        return result.get('stdout', '')
+
+    def export(self, package_name: str, package_code_path: str, package_joern_path: str, language: str,
+               cpg_format: str = 'dot', export_method_graphs: bool = True, timeout: int = 80):
+        """
+        parse the package and export pdg, cfg and cpg in one round trip,
+        the graphs are exported into a temporary directory and moved into package_joern_path on success,
+        so that a late export of a timed out script never mixes with the output of the fallback
+        :param export_method_graphs: export the pdg and cfg of every method
+        """
+        export_path = tempfile.mkdtemp(dir=os.path.dirname(package_joern_path),
+                                       prefix=f".{os.path.basename(package_joern_path)}-")
+        try:
+            method_export = ''
+            if export_method_graphs:
+                method_export = METHOD_EXPORT_SCRIPT.format(pdg_dir=json.dumps(os.path.join(export_path, 'pdg')),
+                                                            cfg_dir=json.dumps(os.path.join(export_path, 'cfg')))
+            script = EXPORT_SCRIPT.format(code_path=json.dumps(os.path.abspath(package_code_path)),
+                                          project=json.dumps(f"{package_name}-{os.getpid()}"),
+                                          language=json.dumps(language),
+                                          method_export=method_export,
+                                          cpg_dir=json.dumps(os.path.join(export_path, 'cpg')),
+                                          exporter=CPG_EXPORTERS[cpg_format])
+            self.query(script, timeout=timeout)
+            if not os.path.exists(os.path.join(export_path, 'cpg', CPG_FILES[cpg_format])):
+                raise JoernServerError(f"Joern server did not export the cpg of {package_name}")
+            for directory in os.listdir(export_path):
+                os.replace(os.path.join(export_path, directory), os.path.join(package_joern_path, directory))
+        finally:
+            shutil.rmtree(export_path, ignore_errors=True)
+
+
+# format of the full cpg export, graphson is read without networkx
+CPG_EXPORTERS = {'dot': 'dot.DotExporter', 'graphson': 'graphson.GraphSONExporter'}
+cpg_format = 'dot'
+
+_joern_servers: list[JoernServer] = []
+
+
+def set_cpg_format(export_format: str):
+    """
+    :param export_format: dot or graphson
+    """
+    global cpg_format
+    cpg_reader.set_cpg_format(export_format)
+    cpg_format = export_format
+
+
+def use_joern_server(addresses: str, spawn: bool = False):
+    """
+    send the following exports to Joern servers, a server exports one package at a time
+    :param addresses: host:port of the servers, separated by commas
+    :param spawn: start the servers as child processes
+    """
+    global _joern_servers
+    _joern_servers = []
+    for address in addresses.split(','):
+        host, port = address.strip().rsplit(':', 1)
+        _joern_servers.append(JoernServer(host, int(port), spawn=spawn))
+
+
+@contextmanager
+def acquire_joern_server():
+    """
+    the first idle server, or wait for the server of this process if every server is busy
+    """
+    for server in _joern_servers:
+        with server.locked(blocking=False) as acquired:
+            if acquired:
+                yield server
+                return
+    server = _joern_servers[os.getpid() % len(_joern_servers)]
+    with server.locked():
+        yield server
 
 
 def joern_export(package_name: str, package_code_path: str, joern_workspace_path: str, language: str,
-                 overwrite: bool = False):
+                 overwrite: bool = False, export_method_graphs: bool = True):
     """
     export cpg and pdg, save in joern_workspace_path/package_name/cpg, joern_workspace_path/package_name/pdg,
     joern_workspace_path/package_name/cfg
@@ -15,6 +205,8 @@ def joern_export(package_name: str, package_code_path: str, joern_workspace_path
     :param joern_workspace_path: joern workspace path
     :param language: language (javascript)
     :param overwrite: overwrite previous output
+    :param export_method_graphs: export the per-method pdg and cfg, only the cpg is needed when the pdgs are derived
+    from it
     """
     package_joern_path = os.path.abspath(os.path.join(joern_workspace_path, package_name))
     if os.path.exists(package_joern_path) and not overwrite:
@@ -26,18 +218,36 @@ def joern_export(package_name: str, package_code_path: str, joern_workspace_path
     cfg_dir = os.path.join(package_joern_path, 'cfg')
     cpg_dir = os.path.join(package_joern_path, 'cpg')
     os.makedirs(package_joern_path, exist_ok=True)
+    if _joern_servers:
+        try:
+            with acquire_joern_server() as server:
+                server.export(package_name, package_code_path, package_joern_path, language, cpg_format,
+                              export_method_graphs)
+            return
+        except (requests.RequestException, ValueError, JoernServerError) as e:
+
+            # fall back to the command line tools
+            print(f"Joern server export failed: {e}")
+            for directory in [pdg_dir, cfg_dir, cpg_dir]:
+                shutil.rmtree(directory, ignore_errors=True)
     subprocess.run(['joern-parse', '--language', language, os.path.abspath(package_code_path)], cwd=package_joern_path,
                    timeout=20)
-    subprocess.run(['joern-export', '--repr', 'pdg', '--out', os.path.abspath(pdg_dir)], cwd=package_joern_path,
-                   timeout=20)
-    subprocess.run(['joern-export', '--repr', 'cfg', '--out', os.path.abspath(cfg_dir)], cwd=package_joern_path,
-                   timeout=20)
-    subprocess.run(['joern-export', '--repr', 'all', '--out', os.path.abspath(cpg_dir)], cwd=package_joern_path,
-                   timeout=20)
+    if export_method_graphs:
+        subprocess.run(['joern-export', '--repr', 'pdg', '--out', os.path.abspath(pdg_dir)], cwd=package_joern_path,
+                       timeout=20)
+        subprocess.run(['joern-export', '--repr', 'cfg', '--out', os.path.abspath(cfg_dir)], cwd=package_joern_path,
+                       timeout=20)
+    subprocess.run(['joern-export', '--repr', 'all', '--format', cpg_format, '--out', os.path.abspath(cpg_dir)],
+                   cwd=package_joern_path, timeout=20)
 
 
-def joern_preprocess(package_dir: str, pdg_dir: str, cfg_dir: str, cpg_dir: str):
-    cpg = nx.nx_agraph.read_dot(os.path.join(cpg_dir, 'export.dot'))
+def joern_preprocess(package_dir: str, pdg_dir: str, cfg_dir: str, cpg_dir: str, cpg: CPG = None):
+    """
+    merge the cfg and the node info of the cpg into each pdg
+    :param cpg: the loaded cpg, read from cpg_dir if not given
+    """
+    if cpg is None:
+        cpg = CPG(cpg_dir)
     for pdg_file in os.listdir(pdg_dir):
         file_id = pdg_file.split('-')[0]
         pdg: nx.MultiDiGraph = nx.nx_agraph.read_dot(os.path.join(pdg_dir, pdg_file))
@@ -57,7 +267,7 @@ def joern_preprocess(package_dir: str, pdg_dir: str, cfg_dir: str, cpg_dir: str)
         method_node = None
         param_nodes = []
         for node in pdg.nodes:
-            for key, value in cpg.nodes[node].items():
+            for key, value in cpg.get_node(int(node)).get_attr().items():
                 pdg.nodes[node][key] = value
             pdg.nodes[node]['NODE_TYPE'] = pdg.nodes[node]['label']
             node_type = pdg.nodes[node]['NODE_TYPE']
@@ -84,44 +294,7 @@ def add_edge(pdg: nx.MultiDiGraph, package_dir, method_node, param_nodes):
     if len(param_nodes) > 0:
         method_name = pdg.nodes[method_node]['NAME']
         if re.search(r'<lambda>\d*', method_name):
-
-            js_file_path = os.path.join(package_dir, pdg.nodes[method_node]['FILENAME'])
-            start_line = int(pdg.nodes[method_node]['LINE_NUMBER'])
-            start_column = int(pdg.nodes[method_node]['COLUMN_NUMBER'])
-            end_line = int(pdg.nodes[method_node]['LINE_NUMBER_END'])
-            end_column = int(pdg.nodes[method_node]['COLUMN_NUMBER_END'])
-            code_snippet = ""
-            with open(js_file_path, 'r') as file:
-                current_line_number = 1
-                for line in file:
-                    if current_line_number == start_line:
-                        code_snippet += line[start_column - 1:]  # Adjust for 0-indexing
-                    elif start_line < current_line_number < end_line:
-                        code_snippet += line
-                    elif current_line_number == end_line:
-                        code_snippet += line[:end_column]  # Adjust for 0-indexing
-                        break
-                    current_line_number += 1
-
-            # formal parameter in lambda function
-            ast_parser = ASTParser(code_snippet, 'javascript')
-            formal_parameter_query = '(formal_parameters)@formal'
-            query_result = ast_parser.query_oneshot(formal_parameter_query)
-            formal_parameter_list = []
-            if query_result:
-                named_children = query_result.named_children
-                for child in named_children:
-                    formal_parameter_list.append(child.text.decode())
-
-            # param in arrow function
-            arrow_function_parameters_query = """
-            (arrow_function
-	            parameter: (identifier)@identifier
-            )
-            """
-            query_result = ast_parser.query_oneshot(arrow_function_parameters_query)
-            if query_result:
-                formal_parameter_list.append(query_result.text.decode())
+            formal_parameter_list = lambda_formal_parameters(package_dir, pdg.nodes[method_node])
             for param_node in param_nodes:
                 param_code = pdg.nodes[param_node]['CODE']
                 if param_code in formal_parameter_list:
@@ -129,3 +302,48 @@ def add_edge(pdg: nx.MultiDiGraph, package_dir, method_node, param_nodes):
         else:
             for param_node in param_nodes:
                 pdg.add_edge(method_node, param_node, label='DDG')
+
+
+def lambda_formal_parameters(package_dir, method_attr: dict) -> list[str]:
+    """
+    read the formal parameters of a lambda function from its source code
+    :param method_attr: attributes of the METHOD node
+    """
+    js_file_path = os.path.join(package_dir, method_attr['FILENAME'])
+    start_line = int(method_attr['LINE_NUMBER'])
+    start_column = int(method_attr['COLUMN_NUMBER'])
+    end_line = int(method_attr['LINE_NUMBER_END'])
+    end_column = int(method_attr['COLUMN_NUMBER_END'])
+    code_snippet = ""
+    with open(js_file_path, 'r') as file:
+        current_line_number = 1
+        for line in file:
+            if current_line_number == start_line:
+                code_snippet += line[start_column - 1:]  # Adjust for 0-indexing
+            elif start_line < current_line_number < end_line:
+                code_snippet += line
+            elif current_line_number == end_line:
+                code_snippet += line[:end_column]  # Adjust for 0-indexing
+                break
+            current_line_number += 1
+
+    # formal parameter in lambda function
+    ast_parser = ASTParser(code_snippet, 'javascript')
+    formal_parameter_query = '(formal_parameters)@formal'
+    query_result = ast_parser.query_oneshot(formal_parameter_query)
+    formal_parameter_list = []
+    if query_result:
+        named_children = query_result.named_children
+        for child in named_children:
+            formal_parameter_list.append(child.text.decode())
+
+    # param in arrow function
+    arrow_function_parameters_query = """
+    (arrow_function
+        parameter: (identifier)@identifier
+    )
+    """
+    query_result = ast_parser.query_oneshot(arrow_function_parameters_query)
+    if query_result:
+        formal_parameter_list.append(query_result.text.decode())
+    return formal_parameter_list
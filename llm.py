@@ -1,8 +1,14 @@
-from openai import OpenAI
+from __future__ import annotations
+
+import asyncio
 import json
+import os
+import random
 import re
+import threading
 from category import category_doc
-import time
+from llm_backend import LLMBackend, OpenAIBackend, LocalBackend, RuleBackend
+from llm_cache import LLMCache, prompt_key
 
 # add your organization here
 organization = ""
@@ -10,6 +16,11 @@ organization = ""
 api_key = ''
 model_3 = 'gpt-3.5-turbo-0125'
 
+# requests in flight at the same time, shared by all the callers of the process
+max_concurrency = 8
+# upper bound of the backoff between two attempts in seconds
+max_delay = 30
+
 classes = """
 <1> [manipulate the path] Construct the path of the file. Work with the path.
 <2> [read input data from hardware devices] Create a new serial port connection. Read inputs from connected hardware devices such as keyboards, mice, and sensors.
@@ -54,7 +65,7 @@ classes = """
 """
 
 
-def llm_classification(description):
+async def llm_classification_async(description):
     messages = [
         {
             "role": "system", "content": f"""
@@ -67,7 +78,7 @@ You are an expert in the field of programming, and Your task is to classify an A
             "role": "user", "content": f"""{description}"""
         }
     ]
-    answer = connect_with_retry(messages, model=model_3)
+    answer = await connect_with_retry_async(messages, model=model_3, function='llm_classification')
     log_content = ''
     lines = answer.splitlines()
     pattern = r'(\d+)'
@@ -89,7 +100,11 @@ You are an expert in the field of programming, and Your task is to classify an A
     return sub_type_list
 
 
-def llm_classification_comment_with_code_summary(comment, code_summary):
+def llm_classification(description):
+    return run(llm_classification_async(description))
+
+
+async def llm_classification_comment_with_code_summary_async(comment, code_summary):
     messages = [
         {
             "role": "system", "content": f"""
@@ -102,7 +117,8 @@ You are an expert in the field of programming, and your task is to classify the
             "role": "user", "content": f"""comment:{comment}, code summary: {code_summary}"""
         }
     ]
-    answer = connect_with_retry(messages, model=model_3)
+    answer = await connect_with_retry_async(messages, model=model_3,
+                                            function='llm_classification_comment_with_code_summary')
     log_content = ''
     lines = answer.splitlines()
     pattern = r'(\d+)'
@@ -124,7 +140,11 @@ You are an expert in the field of programming, and your task is to classify the
     return sub_type_list
 
 
-def llm_shell_command_interpret(shell_command):
+def llm_classification_comment_with_code_summary(comment, code_summary):
+    return run(llm_classification_comment_with_code_summary_async(comment, code_summary))
+
+
+async def llm_shell_command_interpret_async(shell_command):
     messages = [
         {
             "role": "system", "content": """
@@ -159,7 +179,7 @@ def llm_shell_command_interpret(shell_command):
             "role": "user", "content": f"""{shell_command}"""
         }
     ]
-    answer = connect_with_retry(messages)
+    answer = await connect_with_retry_async(messages, function='llm_shell_command_interpret')
 
     # pre process
     start_index = answer.find('{')
@@ -172,7 +192,11 @@ def llm_shell_command_interpret(shell_command):
         raise json.JSONDecodeError(f"llm shell command interpret with input: {answer} has wrong answer format")
 
 
-def llm_make_assumption_from_code(code, call_name, language):
+def llm_shell_command_interpret(shell_command):
+    return run(llm_shell_command_interpret_async(shell_command))
+
+
+async def llm_make_assumption_from_code_async(code, call_name, language):
     messages = [
         {
             "role": "user",
@@ -181,22 +205,31 @@ def llm_make_assumption_from_code(code, call_name, language):
                     """
         }
     ]
-    answer = connect_with_retry(messages, model=model_3)
+    answer = await connect_with_retry_async(messages, model=model_3, function='llm_make_assumption_from_code')
     return answer
 
 
-def llm_make_assumption_from_cate_call_name(qualifier, cate, call_name):
+def llm_make_assumption_from_code(code, call_name, language):
+    return run(llm_make_assumption_from_code_async(code, call_name, language))
+
+
+async def llm_make_assumption_from_cate_call_name_async(qualifier, cate, call_name):
     messages = [
         {
             "role": "user",
             "content": f"""An object created by an API exhibits the following behavior: '{cate}'. There is a method call, `{call_name}`, made on this object. Please infer the behavior of this method call based on the API's behavior and the name of the method call. Make the output as concise as possible. If you can't get any information from the call name, return Unknown"""
         }
     ]
-    answer = connect_with_retry(messages, model=model_3)
+    answer = await connect_with_retry_async(messages, model=model_3,
+                                            function='llm_make_assumption_from_cate_call_name')
     return answer
 
 
-def llm_analyse_script(script):
+def llm_make_assumption_from_cate_call_name(qualifier, cate, call_name):
+    return run(llm_make_assumption_from_cate_call_name_async(qualifier, cate, call_name))
+
+
+async def llm_analyse_script_async(script):
     messages = [
         {
             "role": "system", "content": """
@@ -218,7 +251,7 @@ def llm_analyse_script(script):
             "role": "user", "content": f"""{script}"""
         }
     ]
-    answer = connect_with_retry(messages)
+    answer = await connect_with_retry_async(messages, function='llm_analyse_script')
 
     # pre process
     start_index = answer.find('{')
@@ -231,7 +264,11 @@ def llm_analyse_script(script):
         raise json.JSONDecodeError(f"llm_analyse_script with input: {answer} has wrong answer format")
 
 
-def llm_run_executable_file(file_name):
+def llm_analyse_script(script):
+    return run(llm_analyse_script_async(script))
+
+
+async def llm_run_executable_file_async(file_name):
     messages = [
         {
             "role": "system",
@@ -250,14 +287,18 @@ The answer should only be Yes or No.
         }
     ]
 
-    answer = connect_with_retry(messages, model=model_3)
+    answer = await connect_with_retry_async(messages, model=model_3, function='llm_run_executable_file')
     if re.search(r'Yes', answer, re.IGNORECASE):
         return True
     else:
         return False
 
 
-def llm_code_summary(code):
+def llm_run_executable_file(file_name):
+    return run(llm_run_executable_file_async(file_name))
+
+
+async def llm_code_summary_async(code):
     messages = [
         {
             "role": "user",
@@ -266,11 +307,15 @@ def llm_code_summary(code):
         """
         }
     ]
-    answer = connect_with_retry(messages)
+    answer = await connect_with_retry_async(messages, function='llm_code_summary')
     return answer
 
 
-def llm_execute_command_analysis(command):
+def llm_code_summary(code):
+    return run(llm_code_summary_async(code))
+
+
+async def llm_execute_command_analysis_async(command):
     messages = [
         {
             "role": "system",
@@ -294,14 +339,18 @@ def llm_execute_command_analysis(command):
             "role": "user", "content": f"""{command}"""
         }
     ]
-    answer = connect_with_retry(messages, model=model_3)
+    answer = await connect_with_retry_async(messages, model=model_3, function='llm_execute_command_analysis')
     if re.search(r'Yes', answer, re.IGNORECASE):
         return True
     else:
         return False
 
 
-def llm_read_file_command_analysis(file_path):
+def llm_execute_command_analysis(command):
+    return run(llm_execute_command_analysis_async(command))
+
+
+async def llm_read_file_command_analysis_async(file_path):
     messages = [
         {
             "role": "system",
@@ -322,14 +371,18 @@ The answer should only be Yes or No.
             "role": "user", "content": f"""{file_path}"""
         }
     ]
-    answer = connect_with_retry(messages, model=model_3)
+    answer = await connect_with_retry_async(messages, model=model_3, function='llm_read_file_command_analysis')
     if re.search(r'Yes', answer, re.IGNORECASE):
         return True
     else:
         return False
 
 
-def llm_write_file_command_analysis(file_path):
+def llm_read_file_command_analysis(file_path):
+    return run(llm_read_file_command_analysis_async(file_path))
+
+
+async def llm_write_file_command_analysis_async(file_path):
     messages = [
         {
             "role": "system",
@@ -348,14 +401,18 @@ def llm_write_file_command_analysis(file_path):
             "role": "user", "content": f"""{file_path}"""
         }
     ]
-    answer = connect_with_retry(messages, model=model_3)
+    answer = await connect_with_retry_async(messages, model=model_3, function='llm_write_file_command_analysis')
     if re.search(r'Yes', answer, re.IGNORECASE):
         return True
     else:
         return False
 
 
-def llm_suspicious_url(url: str):
+def llm_write_file_command_analysis(file_path):
+    return run(llm_write_file_command_analysis_async(file_path))
+
+
+async def llm_suspicious_url_async(url: str):
     messages = [
         {
             "role": "system",
@@ -376,14 +433,18 @@ def llm_suspicious_url(url: str):
             "role": "user", "content": f"""{url}"""
         }
     ]
-    answer = connect_with_retry(messages, model=model_3)
+    answer = await connect_with_retry_async(messages, model=model_3, function='llm_suspicious_url')
     if re.search(r'suspicios', answer, re.IGNORECASE):
         return True
     else:
         return False
 
 
-def llm_dynamically_created_program_analysis(program_string):
+def llm_suspicious_url(url: str):
+    return run(llm_suspicious_url_async(url))
+
+
+async def llm_dynamically_created_program_analysis_async(program_string):
     messages = [
         {
             "role": "user",
@@ -393,36 +454,194 @@ def llm_dynamically_created_program_analysis(program_string):
                     """
         }
     ]
-    answer = connect_with_retry(messages, model=model_3)
+    answer = await connect_with_retry_async(messages, model=model_3,
+                                            function='llm_dynamically_created_program_analysis')
     if re.search(r'Yes', answer, re.IGNORECASE):
         return True
     else:
         return False
 
 
-def connect_with_retry(prompt, max_attempts=5, delay=1, model=model_3):
-    LLM_client = OpenAI(organization=organization, api_key=api_key)
-    attempts = 0
-    while attempts < max_attempts:
-        try:
-            completion = LLM_client.chat.completions.create(
-                model=model,
-                messages=prompt,
-                temperature=0.7,
-                max_tokens=2048
-            )
-            answer = completion.choices[0].message.content
-            # Attempt to establish the connection here
-            if attempts > max_attempts - 1:
-                raise ConnectionError("Connection failed")
-            else:
+def llm_dynamically_created_program_analysis(program_string):
+    return run(llm_dynamically_created_program_analysis_async(program_string))
+
+
+_loop: asyncio.AbstractEventLoop | None = None
+_loop_lock = threading.Lock()
+_backend: LLMBackend | None = None
+_semaphore: asyncio.Semaphore | None = None
+
+# judgements that only depend on their input, their answers are cached
+CACHEABLE_JUDGEMENTS = {'llm_execute_command_analysis', 'llm_read_file_command_analysis',
+                        'llm_write_file_command_analysis', 'llm_suspicious_url', 'llm_shell_command_interpret',
+                        'llm_analyse_script'}
+
+# disk cache of the judgements, see use_cache
+_cache: LLMCache | None = None
+# key: prompt key, value: future of the answer of the request in flight
+_in_flight: dict[str, asyncio.Future] = {}
+
+
+def use_cache(cache_dir: str, ttl: int = 30 * 24 * 3600):
+    """
+    answer the judgements that only depend on their input from a disk cache
+    :param cache_dir: directory of the cache, it can be shared by many processes
+    :param ttl: seconds an answer is valid
+    """
+    global _cache
+    _cache = LLMCache(cache_dir, ttl)
+
+
+def use_backend(backend: LLMBackend):
+    """
+    answer the judgements with the given backend instead of the OpenAI API
+    """
+    global _backend
+    _backend = backend
+
+
+def set_backend(name: str, endpoint: str = None, model: str = None):
+    """
+    :param name: openai, local or rule
+    :param endpoint: url of the OpenAI-compatible API of the local backend, e.g. http://127.0.0.1:8000/v1
+    :param model: model used for every judgement
+    """
+    if name == 'local':
+        if endpoint is None:
+            raise ValueError("The local backend needs the url of its endpoint")
+        use_backend(LocalBackend(endpoint, model))
+    elif name == 'rule':
+        use_backend(RuleBackend())
+    else:
+        use_backend(OpenAIBackend(organization, api_key, base_url=endpoint, model=model))
+
+
+def get_backend() -> LLMBackend:
+    global _backend
+    if _backend is None:
+        _backend = OpenAIBackend(organization, api_key)
+    return _backend
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """
+    the event loop of the llm requests, it runs in a daemon thread, so that synchronous callers can wait on it
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='llm', daemon=True).start()
+            _loop = loop
+    return _loop
+
+
+def run(coroutine):
+    """
+    run a coroutine on the llm event loop and wait for its result
+    """
+    return asyncio.run_coroutine_threadsafe(coroutine, get_loop()).result()
+
+
+def gather(coroutines: list) -> list:
+    """
+    run the llm judgements concurrently, bounded by max_concurrency
+    :param coroutines: e.g. [llm_suspicious_url_async(url), llm_read_file_command_analysis_async(path)]
+    :return: the answers in the order of the coroutines
+    """
+    if not coroutines:
+        return []
+
+    async def gather_all():
+        return await asyncio.gather(*coroutines)
+
+    return run(gather_all())
+
+
+def _after_fork_in_child():
+    # the thread of the loop does not exist in a forked child
+    global _loop, _loop_lock, _semaphore
+    _loop = None
+    _loop_lock = threading.Lock()
+    _semaphore = None
+    if _backend is not None:
+        _backend.after_fork()
+    _in_flight.clear()
+    if _cache is not None:
+        _cache.after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+async def connect_with_retry_async(prompt, max_attempts=5, delay=1, model=model_3, function=None):
+    """
+    answer the prompt from the cache if the judgement only depends on its input, otherwise send it
+    :param function: name of the judgement
+    """
+    if function not in CACHEABLE_JUDGEMENTS or _cache is None:
+        return await request_with_retry(prompt, max_attempts, delay, model, function)
+    backend = get_backend()
+    key = prompt_key(function, f"{backend.name}:{backend.effective_model(model)}", prompt)
+    # the SQLite calls wait for the lock of the file shared by the workers, they run in the executor of the loop,
+    # so that the other requests of the loop go on meanwhile
+    loop = asyncio.get_running_loop()
+    while True:
+        if key in _in_flight:
+            # the same prompt is being sent, e.g. the same url in two matches of a package,
+            # None means that request failed, then the first waiter sends the prompt again and the others wait for it
+            answer = await _in_flight[key]
+            if answer is not None:
                 return answer
+            continue
+        answer = await loop.run_in_executor(None, _cache.lookup, key)
+        if answer is not None:
+            return answer
+
+        # another request of the prompt may have started during the lookup
+        if key not in _in_flight:
+            break
+
+    future = loop.create_future()
+    _in_flight[key] = future
+    answer = None
+    try:
+        answer = await request_with_retry(prompt, max_attempts, delay, model, function)
+
+        # the waiting requests get the answer before it is stored
+        future.set_result(answer)
+        await loop.run_in_executor(None, _cache.store, key, function, model, answer)
+    finally:
+        if not future.done():
+            future.set_result(None)
+        if _in_flight.get(key) is future:
+            del _in_flight[key]
+    return answer
+
 
+async def request_with_retry(prompt, max_attempts=5, delay=1, model=model_3, function=None):
+    """
+    send the prompt to the backend, a failed attempt is retried after an exponential backoff with jitter
+    """
+    global _semaphore
+    backend = get_backend()
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(max_concurrency)
+    for attempt in range(max_attempts):
+        try:
+            async with _semaphore:
+                return await backend.complete(prompt, model, function)
         except Exception:
-            attempts += 1
-            if attempts < max_attempts:
-                print(f"Retrying in {delay} seconds...")
-                time.sleep(delay)
+            if attempt < max_attempts - 1:
+                backoff = min(max_delay, delay * 2 ** attempt)
+                wait = backoff / 2 + random.uniform(0, backoff / 2)
+                print(f"Retrying in {wait:.1f} seconds...")
+                await asyncio.sleep(wait)
 
     # If max attempts are reached without successful connection, raise an exception
-    raise ConnectionError("Failed to establish connection to OpenAI after maximum attempts")
+    raise ConnectionError(f"Failed to establish connection to {backend.name} backend after maximum attempts")
+
+
+def connect_with_retry(prompt, max_attempts=5, delay=1, model=model_3, function=None):
+    return run(connect_with_retry_async(prompt, max_attempts, delay, model, function))
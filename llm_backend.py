@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import json
+import re
+import rule_engine
+
+
+class LLMBackend:
+    """
+    answers the messages of an llm judgement, the name is part of the key of the cached answers
+    """
+    name = ''
+
+    async def complete(self, messages: list[dict], model: str, function: str = None) -> str:
+        """
+        :param messages: chat messages of the judgement
+        :param model: model asked by the judgement
+        :param function: name of the judgement, e.g. llm_suspicious_url
+        :return: text of the answer
+        """
+        raise NotImplementedError
+
+    def effective_model(self, model: str) -> str:
+        """
+        the model that answers a judgement asking for the given model
+        """
+        return model
+
+    def after_fork(self):
+        pass
+
+
+class OpenAIBackend(LLMBackend):
+    name = 'openai'
+
+    def __init__(self, organization: str = '', api_key: str = '', base_url: str = None, model: str = None,
+                 temperature: float = 0.7):
+        """
+        :param base_url: url of the API, None is the OpenAI API
+        :param model: model used for every judgement instead of the model asked by the judgement
+        """
+        self.organization = organization
+        self.api_key = api_key
+        self.base_url = base_url
+        self.model = model
+        self.temperature = temperature
+        self.client = None
+
+    def effective_model(self, model: str) -> str:
+        return self.model if self.model else model
+
+    async def complete(self, messages: list[dict], model: str, function: str = None) -> str:
+        if self.client is None:
+            from openai import AsyncOpenAI
+
+            # the retries of the client itself are replaced by the backoff of llm.request_with_retry
+            self.client = AsyncOpenAI(organization=self.organization, api_key=self.api_key, base_url=self.base_url,
+                                      max_retries=0)
+        completion = await self.client.chat.completions.create(
+            model=self.effective_model(model),
+            messages=messages,
+            temperature=self.temperature,
+            max_tokens=2048
+        )
+        return completion.choices[0].message.content
+
+    def after_fork(self):
+        # the connections of the client belong to the parent
+        self.client = None
+
+
+class LocalBackend(OpenAIBackend):
+    """
+    OpenAI-compatible chat completions endpoint on the scan node or the local network, e.g. vLLM, llama.cpp or Ollama
+    """
+    name = 'local'
+
+    def __init__(self, base_url: str, model: str = None, api_key: str = 'local', temperature: float = 0.7):
+        """
+        :param base_url: e.g. http://127.0.0.1:8000/v1
+        :param model: model served by the endpoint
+        """
+        super().__init__(api_key=api_key, base_url=base_url, model=model, temperature=temperature)
+        self.name = f'local:{base_url}'
+
+
+def _yes_no_answer(indicator_kind: str):
+    return lambda text: 'Yes' if rule_engine.verdict(indicator_kind, text) else 'No'
+
+
+def _shell_command_answer(text: str) -> str:
+    files = re.findall(r'\bnode\s+([\w./-]+)', text)
+    judgement = 'malicious' if rule_engine.verdict('command', text) else 'benign'
+    return json.dumps({'Description': {'1': text}, 'Judgement': judgement, 'File': files})
+
+
+def _script_answer(text: str) -> str:
+    if re.match(r'\s*(node|start)\s', text + ' '):
+        return json.dumps({'Type': 'Node', 'Run': re.findall(r'\bnode\s+([\w./-]+)', text)})
+    return json.dumps({'Type': 'Shell_Command'})
+
+
+class RuleBackend(LLMBackend):
+    """
+    deterministic answers without a model, for tests and for scan nodes without any endpoint,
+    the yes or no judgements answer Yes only on a malicious indicator of rule_engine,
+    the classifications answer class 40 (Others) and the descriptions Unknown
+    """
+    name = 'rule'
+
+    def effective_model(self, model: str) -> str:
+        return 'rule_engine'
+
+    # key: judgement, value: answer of the user message
+    ANSWERS = {
+        'llm_classification': lambda text: '40',
+        'llm_classification_comment_with_code_summary': lambda text: '40',
+        'llm_shell_command_interpret': _shell_command_answer,
+        'llm_analyse_script': _script_answer,
+        'llm_run_executable_file': _yes_no_answer('executable'),
+        'llm_execute_command_analysis': _yes_no_answer('command'),
+        'llm_read_file_command_analysis': _yes_no_answer('read_file'),
+        'llm_write_file_command_analysis': _yes_no_answer('write_file'),
+        'llm_suspicious_url': lambda text: 'suspicios' if rule_engine.verdict('url', text) else 'benign',
+        'llm_dynamically_created_program_analysis': _yes_no_answer('program'),
+    }
+
+    async def complete(self, messages: list[dict], model: str, function: str = None) -> str:
+        if function in self.ANSWERS:
+            return self.ANSWERS[function](messages[-1]['content'])
+        return 'Unknown'
@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# bump when the prompts or the parsing of the answers change
+CACHE_VERSION = '1'
+
+# the expired and the least recently used entries are removed after every EVICT_INTERVAL stores
+EVICT_INTERVAL = 256
+
+
+def prompt_key(function: str, model: str, prompt: list[dict]) -> str:
+    """
+    SHA-256 over the judgement, the model and the messages
+    """
+    digest = hashlib.sha256(f"{CACHE_VERSION}:{function}:{model}:".encode())
+    digest.update(json.dumps(prompt, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+class LLMCache:
+    """
+    answers of the llm judgements in a SQLite file, shared by the processes that use the same cache_dir
+    """
+
+    def __init__(self, cache_dir: str, ttl: int = 30 * 24 * 3600, max_bytes: int = 256 << 20,
+                 max_entries: int = 1000000):
+        """
+        :param ttl: seconds an answer is valid
+        :param max_bytes: total size of the answers
+        :param max_entries: number of answers
+        """
+        self.cache_dir = cache_dir
+        self.path = os.path.join(cache_dir, 'llm_cache.sqlite')
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.connection: sqlite3.Connection | None = None
+        self.stores = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get_connection(self) -> sqlite3.Connection:
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS answers (key TEXT PRIMARY KEY, function TEXT, "
+                                    "model TEXT, answer TEXT, size INTEGER, created REAL, accessed REAL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS answers_accessed ON answers (accessed)")
+            self.connection.commit()
+        return self.connection
+
+    def lookup(self, key: str) -> str | None:
+        """
+        :return: cached answer, None if missing or expired
+        """
+        now = time.time()
+        try:
+            with self.lock:
+                connection = self.get_connection()
+                row = connection.execute("SELECT answer, created FROM answers WHERE key = ?", (key,)).fetchone()
+                if row is None or now - row[1] > self.ttl:
+                    return None
+                connection.execute("UPDATE answers SET accessed = ? WHERE key = ?", (now, key))
+                connection.commit()
+                return row[0]
+        except sqlite3.Error as e:
+            print(f"LLM cache lookup failed: {e}")
+            return None
+
+    def store(self, key: str, function: str, model: str, answer: str):
+        now = time.time()
+        try:
+            with self.lock:
+                connection = self.get_connection()
+                connection.execute("INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                   (key, function, model, answer, len(answer.encode()), now, now))
+                connection.commit()
+                self.stores += 1
+                if self.stores % EVICT_INTERVAL == 0:
+                    self.evict()
+        except sqlite3.Error as e:
+            print(f"LLM cache store failed: {e}")
+
+    def evict(self):
+        """
+        remove the expired entries, then the least recently used ones until the cache fits max_bytes and max_entries
+        """
+        connection = self.get_connection()
+        connection.execute("DELETE FROM answers WHERE created < ?", (time.time() - self.ttl,))
+        entries, total_size = connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM answers").fetchone()
+        if entries > self.max_entries or total_size > self.max_bytes:
+            removed = []
+            for key, size in connection.execute("SELECT key, size FROM answers ORDER BY accessed"):
+                if entries <= self.max_entries and total_size <= self.max_bytes:
+                    break
+                removed.append((key,))
+                entries -= 1
+                total_size -= size
+            connection.executemany("DELETE FROM answers WHERE key = ?", removed)
+        connection.commit()
+
+    def after_fork(self):
+        # the child opens its own connection to the file
+        self.lock = threading.Lock()
+        self.connection = None
@@ -3,6 +3,7 @@ import os
 import re
 import shutil
 from npm_pipeline.classes.package import Package
+from common_classes.compact_cpg import load_cpg
 import traceback
 import joern_helper
 from ast_parser import ASTParser
@@ -11,20 +12,67 @@ import signal
 import jsbeautifier
 from custom_exception import PackageJsonNotFoundException
 from obfuscation_detect import detect_obfuscation
+from result_cache import ResultCache, report_files
+import npm_pipeline.database as db_query
+import llm
 import subprocess
 
 timeout_limit = 600
 
+# derive the pdgs from the full cpg, the per-method pdg and cfg are not exported
+pdg_from_cpg = False
+
+# load the cpg into CompactCPG, the array-backed representation
+compact_cpg = False
+
+# number of processes of the run-time analysis of one package
+run_time_workers = 1
+
 
 def timeout_handler(signum, frame):
     raise TimeoutError("Time out")
 
 
-def timeout(seconds):
+def set_timeout_limit(seconds: int):
+    """
+    change the per-package time limit, e.g. inside a batch worker process
+    """
+    global timeout_limit
+    timeout_limit = seconds
+
+
+def set_pdg_from_cpg(enabled: bool):
+    global pdg_from_cpg
+    pdg_from_cpg = enabled
+
+
+def set_compact_cpg(enabled: bool):
+    global compact_cpg
+    compact_cpg = enabled
+
+
+def set_run_time_workers(workers: int):
+    global run_time_workers
+    run_time_workers = workers
+
+
+def analysis_options() -> dict:
+    """
+    settings of this process that change the verdicts, they are part of the key of the result cache
+    """
+    backend = llm.get_backend()
+    return {'pdg_from_cpg': pdg_from_cpg, 'compact_cpg': compact_cpg, 'parallel_run_time': run_time_workers > 1,
+            'llm_backend': backend.name, 'llm_model': backend.effective_model(llm.model_3),
+            'categorise_on_scan': db_query.categorise_on_scan}
+
+
+def timeout(seconds=None):
     def decorator(func):
         def wrapper(*args, **kwargs):
             signal.signal(signal.SIGALRM, timeout_handler)
-            signal.alarm(seconds)
+
+            # the limit is read at call time so that it can be changed per process
+            signal.alarm(seconds if seconds is not None else timeout_limit)
             try:
                 result = func(*args, **kwargs)
             finally:
@@ -36,9 +84,33 @@ def timeout(seconds):
     return decorator
 
 
-@timeout(timeout_limit)
+@timeout()
 def run(package_name: str, report_dir: str, code_dir: str, joern_dir: str, format_dir: str,
-        overwrite=True, generate_report: bool = False):
+        overwrite=True, generate_report: bool = False, cache_dir: str = None):
+    """
+    analyse one package, the result is looked up in the content-addressed cache first if cache_dir is given
+    """
+    package_dir = os.path.join(code_dir, package_name)
+    if cache_dir is None or not os.path.exists(package_dir):
+        return analyse_package(package_name, report_dir, code_dir, joern_dir, format_dir, overwrite, generate_report)
+
+    report_path = os.path.join(report_dir, package_name)
+    cache = ResultCache(cache_dir, options=analysis_options())
+    key = cache.key(package_dir)
+    status = cache.lookup(key, report_path)
+    if status is not None:
+        print(f"{package_name} is found in the result cache")
+        return status
+
+    # a report left by an earlier run is not part of this result
+    previous_files = report_files(report_path)
+    status = analyse_package(package_name, report_dir, code_dir, joern_dir, format_dir, overwrite, generate_report)
+    cache.store(key, status, report_path, previous_files)
+    return status
+
+
+def analyse_package(package_name: str, report_dir: str, code_dir: str, joern_dir: str, format_dir: str,
+                    overwrite=True, generate_report: bool = False):
     report_path = os.path.join(report_dir, package_name)
     os.makedirs(report_path, exist_ok=True)
     package_dir = os.path.join(code_dir, package_name)
@@ -66,25 +138,38 @@ def run(package_name: str, report_dir: str, code_dir: str, joern_dir: str, forma
         pdg_dir = os.path.join(joern_dir, package_name, 'pdg')
         cfg_dir = os.path.join(joern_dir, package_name, 'cfg')
         cpg_dir = os.path.join(joern_dir, package_name, 'cpg')
+        cpg = None
         if os.path.exists(package_joern_path) and not overwrite:
             pass
         else:
             package_preprocess(format_package_dir)
-            joern_helper.joern_export(package_name, format_package_dir, joern_dir, 'javascript', overwrite=overwrite)
+            joern_helper.joern_export(package_name, format_package_dir, joern_dir, 'javascript', overwrite=overwrite,
+                                      export_method_graphs=not pdg_from_cpg)
             cpg_preprocess(cpg_dir)
-            joern_helper.joern_preprocess(format_package_dir, pdg_dir, cfg_dir, cpg_dir)
 
-        if not os.path.exists(pdg_dir):
+            # the cpg is loaded once and shared by the preprocessing and the package
+            cpg = load_cpg(cpg_dir, compact_cpg)
+            if not pdg_from_cpg:
+                joern_helper.joern_preprocess(format_package_dir, pdg_dir, cfg_dir, cpg_dir, cpg)
+
+        if not pdg_from_cpg and not os.path.exists(pdg_dir):
             print(f"{package_name}'s pdg dir is not exist")
             return STATUS_JOERN_ERROR
-        if not os.path.exists(cfg_dir):
+        if not pdg_from_cpg and not os.path.exists(cfg_dir):
             print(f"{package_name}'s cfg path is not exist")
             return STATUS_JOERN_ERROR
         if not os.path.exists(cpg_dir):
             print(f"{package_name}'s cpg path is not exist")
             return STATUS_JOERN_ERROR
-        contents = os.listdir(pdg_dir)
-        package = Package(package_name=package_name, package_dir=format_package_dir, pdg_dir=pdg_dir, cpg_dir=cpg_dir)
+        # a reused workspace keeps a snapshot of the loaded graphs, the cpg of a reused workspace is only read from
+        # cpg_dir by the package if the snapshot is missing or stale
+        package = Package(package_name=package_name, package_dir=format_package_dir, pdg_dir=pdg_dir, cpg_dir=cpg_dir,
+                          cpg=cpg, pdg_from_cpg=pdg_from_cpg, compact_cpg=compact_cpg, snapshot=not overwrite,
+                          run_time_workers=run_time_workers)
+        if pdg_from_cpg:
+            contents = list(package.pdg_dict)
+        else:
+            contents = os.listdir(pdg_dir)
         if package.get_file_number() == 0:
 
             # no js files
@@ -53,3 +53,20 @@ class DepthTree:
                 return True
             current_node = current_node.get_former()
         return False
+
+    def snapshot(self) -> tuple:
+        """
+        state of the tree, identifiers are only appended to the last node, so the number of identifiers
+        of every node from the last node to the root is enough to restore it
+        """
+        chain = []
+        current_node = self.last_node
+        while current_node is not None:
+            chain.append((current_node, len(current_node.get_identifiers())))
+            current_node = current_node.get_former()
+        return self.root, self.last_node, chain
+
+    def restore(self, snapshot: tuple):
+        self.root, self.last_node, chain = snapshot
+        for node, identifier_count in chain:
+            del node.get_identifiers()[identifier_count:]
@@ -1,9 +1,12 @@
 from __future__ import annotations
 
-import copy
 import os
+import multiprocessing as mp
 from npm_pipeline.classes.package_json import PackageJson
 from common_classes.cpg import CPG
+from common_classes.cpg_reader import find_cpg_file
+from common_classes.compact_cpg import load_cpg
+from common_classes.snapshot import source_fingerprint, read_snapshot, write_snapshot
 from common_classes.pdg import PDG
 from common_classes.pdg_node import PDGNode
 from common_classes.cpg_node import CPGNode
@@ -12,7 +15,7 @@ from npm_pipeline.classes.file import File
 from common_classes.cpg_pdg_edge import Edge
 from npm_pipeline.classes.identifier import Identifier
 from common_classes.result import Result
-from ast_parser import ASTParser
+from ast_parser import ASTCache, combine_queries
 import re
 import npm_pipeline.database as db_query
 from common_classes.report import Report
@@ -22,6 +25,100 @@ from module2class import get_class
 from category import category_doc
 
 
+# shapes of a call site, the queries are combined into one so that a call is matched in one pass
+CALL_SHAPE_QUERIES = {
+    'call_expression': """
+        (expression_statement
+            (call_expression
+                (identifier)@id
+            )
+        )@ex
+    """,
+    'subscript_expression': """
+        (expression_statement
+            (call_expression
+                (subscript_expression)@su
+            )
+        )@ex
+    """,
+    'member_expression_1': """
+        (expression_statement
+            (call_expression
+                function: (member_expression
+                    object:(identifier)@identifier
+                    property:(property_identifier)@property
+                )@member_expression
+            )
+        )@ex
+    """,
+    'member_expression_2': """
+        (expression_statement
+            (call_expression
+                function: (member_expression
+                    object:(call_expression
+                        (member_expression
+                            object: (identifier)@identifier
+                            property: (property_identifier)@pro_identifier
+                            )
+                        )@call_expression
+                    property:(property_identifier)@out_pro_identifier
+                )@member_expression
+            )
+        )@ex
+    """,
+    'member_expression_3': """
+        (expression_statement
+            (call_expression
+                function: (member_expression
+                    object:(member_expression
+                        object:(identifier)@identifier
+                        property:(property_identifier)@inner_property_identifier
+                    )
+                    property:(property_identifier)@outer_property_identifier
+                )@member_expression
+            )
+        )@ex
+    """,
+    'require_member_expression': """
+        (expression_statement
+            (call_expression
+                (member_expression
+                    object: (call_expression
+                        function: (identifier)@identifier
+                        arguments: (arguments
+                            (string)@string
+                        )
+                    )
+                    property: (property_identifier)@property_identifier
+                )
+            )
+        )@ex
+    """,
+    'error_member_call_expression': '(ERROR(member_expression(call_expression(identifier))@ca(property_identifier)@pro))',
+    'error_member_expression': """
+        (ERROR
+            (member_expression
+                object: (identifier)@identifier
+                property: (property_identifier)@pro_identifier
+            )
+        )@ex
+    """,
+}
+CALL_SHAPE_QUERY = combine_queries(CALL_SHAPE_QUERIES)
+
+# package of the parallel run-time analysis, inherited by the forked workers
+_forked_package: Package | None = None
+
+
+def _run_time_shard(keys: list[int], generate_report: bool) -> Report:
+    report = Report()
+    _forked_package.run_time_analysis(keys, report, generate_report)
+
+    # a pool worker exits without atexit handlers
+    db_query.flush()
+    return report
+
+
 def joint(result: Result, sub_result: Result):
     sub_result_entrance = sub_result.get_entrance_node()
     if not result.node_is_in(sub_result_entrance):
@@ -36,11 +133,23 @@ def joint(result: Result, sub_result: Result):
 
 
 class Package:
-    def __init__(self, package_name, package_dir, pdg_dir, cpg_dir):
+    def __init__(self, package_name, package_dir, pdg_dir, cpg_dir, cpg: CPG = None, pdg_from_cpg: bool = False,
+                 compact_cpg: bool = False, snapshot: bool = False, run_time_workers: int = 1):
+        """
+        :param cpg: the loaded cpg, read from cpg_dir if not given
+        :param pdg_from_cpg: derive the pdg of every method from the cpg instead of reading the dot files in pdg_dir
+        :param compact_cpg: read the cpg into CompactCPG
+        :param snapshot: load the cpg and the pdgs from the snapshot next to pdg_dir, it is written if missing or stale
+        :param run_time_workers: number of processes of the run-time analysis, more than one needs fork
+        """
         self.package_name: str = package_name
         self.package_dir: str = package_dir
         self.pdg_dir = pdg_dir
         self.cpg_dir = cpg_dir
+        self.pdg_from_cpg = pdg_from_cpg
+        self.compact_cpg = compact_cpg
+        self.run_time_workers = run_time_workers
+        self.snapshot_path = os.path.join(os.path.dirname(os.path.abspath(pdg_dir)), 'snapshot.bin') if snapshot else None
         self.js_file_number = 0
         self.install_time_behavior = None
         self.import_time_behavior = None
@@ -50,12 +159,16 @@ class Package:
         self.package_json = PackageJson(self.package_dir)
         self.js_file_list = self.__iterate_file()
         self.files: dict[str, File] = {}
+        self.ast_cache = ASTCache()  # parsed snippets and source files
         self.depth_trees: dict[str, DepthTree] = {}
         for js_file, raw_code in self.js_file_list.items():
             self.files[js_file] = File(js_file, raw_code)
             self.depth_trees[js_file] = DepthTree(js_file)
-        self.cpg = CPG(self.cpg_dir)  # read the cpg dot
-        self.__build_pdg_dict()  # read the pdg dot
+        if not self.__load_snapshot():
+            self.cpg = cpg if cpg is not None else load_cpg(self.cpg_dir, compact_cpg)  # read the cpg dot
+            self.__build_pdg_dict()  # read the pdg dot
+            self.__write_snapshot()
+        self.__build_pdg_index()
         self.local_module_call_dict: dict[int, PDGNode] = {}
         self.function_call_dict: dict[int, PDGNode] = {}
         self.download_failed_package = set()
@@ -80,15 +193,65 @@ class Package:
     def get_file_number(self):
         return self.js_file_number
 
-    def __build_pdg_dict(self):
-        dot_names = os.listdir(self.pdg_dir)
+    def __snapshot_fingerprint(self) -> dict:
+        sources = [find_cpg_file(self.cpg_dir)]
+        if not self.pdg_from_cpg:
+            sources.append(self.pdg_dir)
+        return source_fingerprint(sources, {'pdg_from_cpg': self.pdg_from_cpg, 'compact_cpg': self.compact_cpg})
+
+    def __load_snapshot(self) -> bool:
+        if self.snapshot_path is None:
+            return False
+        data = read_snapshot(self.snapshot_path, self.__snapshot_fingerprint())
+        if data is None:
+            return False
+        self.cpg, self.pdg_dict = data
+        self.pdg_analyzed: dict[int, bool] = {pdg_id: False for pdg_id in self.pdg_dict}
+        return True
+
+    def __write_snapshot(self):
+        if self.snapshot_path is None:
+            return
+        try:
+            write_snapshot(self.snapshot_path, (self.cpg, self.pdg_dict), self.__snapshot_fingerprint())
+        except OSError as e:
+            print(f"Write snapshot failed: {e}")
+
+    def __build_pdg_index(self):
+        """
+        lookups over pdg_dict, the first pdg in pdg_dict wins as in a linear scan
+        """
+        # key: (file, name), value: key in pdg_dict
+        self.pdg_key_by_name: dict[tuple[str, str], int] = {}
 
+        # key: full name
+        self.pdg_by_full_name: dict[str, PDG] = {}
+
+        # (pdg, parameter count) of the functions declared in the files, neither lambda nor :program
+        self.declared_functions: list[tuple[PDG, int]] = []
+        for key, pdg in self.pdg_dict.items():
+            name = pdg.get_name()
+            self.pdg_key_by_name.setdefault((pdg.get_file_name(), name), key)
+            self.pdg_by_full_name.setdefault(pdg.get_full_name(), pdg)
+            if not re.search(r'<lambda>\d*', name) and name != ':program':
+                self.declared_functions.append((pdg, self.get_parameter_count(pdg)))
+
+    def get_pdg_key(self, file_name: str, name: str) -> int | None:
+        return self.pdg_key_by_name.get((file_name, name))
+
+    def __iterate_pdg(self):
+        if self.pdg_from_cpg:
+            for method_id in self.cpg.get_method_ids():
+                yield PDG.from_cpg(self.cpg, method_id, self.package_dir)
+        else:
+            for dot in os.listdir(self.pdg_dir):
+                yield PDG(pdg_path=os.path.join(self.pdg_dir, dot), cpg=self.cpg)
+
+    def __build_pdg_dict(self):
         # key: (first node id, name, full name, file)
         self.pdg_dict: dict[int, PDG] = {}
         self.pdg_analyzed: dict[int, bool] = {}
-        for dot in dot_names:
-            dot_path = os.path.join(self.pdg_dir, dot)
-            pdg = PDG(pdg_path=dot_path, cpg=self.cpg)
+        for pdg in self.__iterate_pdg():
             if pdg.is_empty():
                 continue
             name = pdg.get_name()
@@ -144,19 +307,15 @@ class Package:
                         install_time_behavior = None
                         file_relative_path = os.path.normpath(os.path.join('package', file))
 
-                        find_pdg = False
-                        for key, value in self.pdg_dict.items():
-
-                            if value.get_name() == ':program' and value.get_file_name() == file_relative_path:
-                                find_pdg = True
-                                if file_relative_path in self.program_behavior:
-                                    install_time_behavior = self.program_behavior[file_relative_path]
-                                else:
-                                    install_time_behavior = self.behavior_gen(file_relative_path, value,
-                                                                              desc='program')
-                                    self.program_behavior[file_relative_path] = install_time_behavior
-                                    self.pdg_analyzed[key] = True
-                                break
+                        key = self.get_pdg_key(file_relative_path, ':program')
+                        if key is not None:
+                            if file_relative_path in self.program_behavior:
+                                install_time_behavior = self.program_behavior[file_relative_path]
+                            else:
+                                install_time_behavior = self.behavior_gen(file_relative_path, self.pdg_dict[key],
+                                                                          desc='program')
+                                self.program_behavior[file_relative_path] = install_time_behavior
+                                self.pdg_analyzed[key] = True
                         if install_time_behavior is not None:
                             install_time_behavior.sensitive_subgraph_extraction(self.cpg, self.package_report)
                             if generate_report:
@@ -175,54 +334,30 @@ class Package:
             print("****Import Time analysis****")
             main_js = self.package_json.get_main()
             main_relative_path = os.path.normpath(os.path.join('package', main_js))
-            find_main_pdg = False
-            for key, value in self.pdg_dict.items():
-                if value.get_name() == ':program' and value.get_file_name() == main_relative_path:
-                    find_main_pdg = True
-                    if main_relative_path in self.program_behavior:
-                        pass
-                    else:
-                        import_time_behavior = self.behavior_gen(main_relative_path, value, desc='program')
-                        self.program_behavior[main_relative_path] = import_time_behavior
-                        self.pdg_analyzed[key] = True
-                        if import_time_behavior is not None:
-                            import_time_behavior.sensitive_subgraph_extraction(self.cpg, self.package_report)
-                            if generate_report:
-                                import_time_behavior.match_rule('IMPORT', self.package_report)
-                    break
+            key = self.get_pdg_key(main_relative_path, ':program')
+            if key is not None and main_relative_path not in self.program_behavior:
+                import_time_behavior = self.behavior_gen(main_relative_path, self.pdg_dict[key], desc='program')
+                self.program_behavior[main_relative_path] = import_time_behavior
+                self.pdg_analyzed[key] = True
+                if import_time_behavior is not None:
+                    import_time_behavior.sensitive_subgraph_extraction(self.cpg, self.package_report)
+                    if generate_report:
+                        import_time_behavior.match_rule('IMPORT', self.package_report)
             if generate_report:
                 self.package_report.write_to_file(report_path)
 
         def run_time_analysis():
             print('****Run Time analysis****')
-            for key, value in self.pdg_dict.items():
-                if self.pdg_analyzed[key] is False:
-                    self.pdg_analyzed[key] = True
-                    self.initialize_depth_trees()
-                    file_name = value.get_file_name()
-
-                    file_pdg = [_value for key, _value in self.pdg_dict.items() if
-                                _value.get_name() == ':program' and _value.get_file_name() == file_name]
-                    if len(file_pdg) == 0:
-                        return
-                    file_pdg = file_pdg[0]
-                    background = self.behavior_gen(file_name, file_pdg, 'program')
-                    function_call_behavior = self.behavior_gen(file_name, value, 'function')
-                    background_nodes = background.get_nodes()
-                    function_nodes = function_call_behavior.get_nodes()
-
-                    in_edges = copy.deepcopy(function_call_behavior.get_in_edges())
-                    for tail, heads in in_edges.items():
-                        for head in heads:
-                            if head not in function_nodes and head in background_nodes:
-                                function_call_behavior.add_node(background_nodes[head])
-                                visited = set()
-
-                                self.add_previous_util(head, background, function_call_behavior, visited)
-                    if function_call_behavior is not None:
-                        function_call_behavior.sensitive_subgraph_extraction(self.cpg, self.package_report)
-                        if generate_report:
-                            function_call_behavior.match_rule("RUN TIME", self.package_report)
+            keys = [key for key, analyzed in self.pdg_analyzed.items() if analyzed is False]
+            if self.run_time_workers > 1 and len(keys) > 1 and 'fork' in mp.get_all_start_methods():
+
+                # a shard does not know the functions analysed by the others as callees
+                print("parallel run-time analysis: a function called from another shard is also analysed on its own, "
+                      "which can add matches that the serial analysis does not report")
+                for report in self.parallel_run_time_analysis(keys, generate_report):
+                    self.package_report.merge(report)
+            else:
+                self.run_time_analysis(keys, self.package_report, generate_report)
 
             if generate_report:
                 self.package_report.write_to_file(report_path)
@@ -236,17 +371,107 @@ class Package:
         else:
             return STATUS_BENIGN
 
-    def add_previous_util(self, current_node: int, background: Result, result: Result, visited: set):
-        if current_node not in visited:
-            visited.add(current_node)
-            if current_node in background.get_in_edges():
+    def run_time_analysis(self, keys: list[int], report: Report, generate_report: bool):
+        """
+        run-time analysis of the functions, a function analyzed before, e.g. as the callee of a former one, is skipped
+        :param keys: keys of the functions in pdg_dict
+        :param report: report of the matched behaviors
+        """
+        # key: file, value: (background, depth trees after the background, class lists of the sensitive nodes)
+        backgrounds: dict[str, tuple[Result, dict[str, tuple], dict[int, list]]] = {}
+        for key in keys:
+            if self.pdg_analyzed[key] is False:
+                self.pdg_analyzed[key] = True
+                value = self.pdg_dict[key]
+                file_name = value.get_file_name()
+
+                file_pdg_key = self.get_pdg_key(file_name, ':program')
+                if file_pdg_key is None:
+                    return
+                if file_name not in backgrounds:
+
+                    # the background of a file is built once, every function of the file starts from it
+                    self.initialize_depth_trees()
+                    background = self.behavior_gen(file_name, self.pdg_dict[file_pdg_key], 'program')
+                    sensitive_classes = {node_id: list(node.get_class_list())
+                                         for node_id, node in background.get_nodes().items()
+                                         if node.is_sensitive_node()}
+                    backgrounds[file_name] = (background,
+                                              {file: tree.snapshot() for file, tree in self.depth_trees.items()},
+                                              sensitive_classes)
+                background, trees, sensitive_classes = backgrounds[file_name]
+                for file, tree in self.depth_trees.items():
+                    tree.restore(trees[file])
+
+                # the subgraph extraction of a former function truncates the class lists of the shared nodes
+                background_nodes = background.get_nodes()
+                for node_id, class_list in sensitive_classes.items():
+                    background_nodes[node_id].set_class_list(list(class_list))
+                function_call_behavior = self.behavior_gen(file_name, value, 'function')
+                function_nodes = function_call_behavior.get_nodes()
+
+                # connect the function to the part of the background it depends on
+                visited = set()
+                in_edges = [(tail, tuple(heads)) for tail, heads in function_call_behavior.get_in_edges().items()]
+                for tail, heads in in_edges:
+                    for head in heads:
+                        if head not in function_nodes and head in background_nodes:
+                            function_call_behavior.add_node(background_nodes[head])
+                            self.add_previous_util(head, background, function_call_behavior, visited)
+                if function_call_behavior is not None:
+                    function_call_behavior.sensitive_subgraph_extraction(self.cpg, report)
+                    if generate_report:
+                        function_call_behavior.match_rule("RUN TIME", report)
+
+    def parallel_run_time_analysis(self, keys: list[int], generate_report: bool) -> list[Report]:
+        """
+        run-time analysis in forked worker processes, the functions of one file are in the same shard,
+        so that the background of a file is built only once
+        :return: report of every shard
+        """
+        global _forked_package
+
+        # key: file, value: keys of its functions
+        file_keys: dict[str, list[int]] = {}
+        for key in keys:
+            file_keys.setdefault(self.pdg_dict[key].get_file_name(), []).append(key)
+
+        # the largest file goes to the shard with the fewest functions
+        shards: list[list[int]] = [[] for _ in range(min(self.run_time_workers, len(file_keys)))]
+        for function_keys in sorted(file_keys.values(), key=len, reverse=True):
+            min(shards, key=len).extend(function_keys)
+        order = {key: index for index, key in enumerate(keys)}
+        for shard in shards:
+            shard.sort(key=order.get)
+
+        # the workers inherit the loaded graphs from the fork
+        _forked_package = self
+        try:
+            with mp.get_context('fork').Pool(len(shards)) as pool:
+                return pool.starmap(_run_time_shard, [(shard, generate_report) for shard in shards])
+        finally:
+            _forked_package = None
 
-                heads = background.get_in_edges()[current_node]
-                for head in heads:
-                    result.add_node(background.get_nodes()[head])
-                    edge = background.get_edges()[(head, current_node)]
-                    result.add_edge(head, current_node, edge.get_attr())
-                    self.add_previous_util(head, background, result, visited)
+    @staticmethod
+    def add_previous_util(current_node: int, background: Result, result: Result, visited: set):
+        """
+        add the nodes of the background that reach current_node, with their edges, to result
+        :param visited: nodes already added, it can be shared by several calls on the same result
+        """
+        background_nodes = background.get_nodes()
+        background_in_edges = background.get_in_edges()
+        background_edges = background.get_edges()
+        stack = [current_node]
+        while stack:
+            current_node = stack.pop()
+            if current_node in visited:
+                continue
+            visited.add(current_node)
+            for head in background_in_edges.get(current_node, ()):
+                result.add_node(background_nodes[head])
+                edge = background_edges[(head, current_node)]
+                result.add_edge(head, current_node, edge.get_attr())
+                stack.append(head)
 
     def behavior_gen(self, filename: str, pdg: PDG, desc: str):
         """
@@ -259,7 +484,7 @@ class Package:
         nodes = pdg.get_nodes()
         first_node = nodes[pdg.get_first_node_id()]
         visited = set()
-        result = Result(self.cpg, self.pdg_dict, self.package_dir, self.package_name)
+        result = Result(self.cpg, self.pdg_dict, self.package_dir, self.package_name, self.ast_cache)
         result.set_entrance_node(first_node)
         self.behavior_gen_util(current_node=first_node,
                                former_node=first_node,
@@ -273,20 +498,18 @@ class Package:
         for file, tree in self.depth_trees.items():
             # empty the tree
             tree.clean()
-        for key, value in self.pdg_dict.items():
+        for value, parameter_count in self.declared_functions:
             name = value.get_name()
-            if not re.search(r'<lambda>\d*', name) and name != ':program':
-                filename = value.get_file_name()
-                if filename in self.files:
-                    self.files[filename].add_function(name)
-                    parameter_count = self.get_parameter_count(value)
-                    function_identifier = Identifier(name=name, line_number=1,
-                                                     type_='FUNCTION_DECLARE',
-                                                     file=filename, node_id=None,
-                                                     pdg=value, parameter_count=parameter_count)
-
-                    # add to the root node
-                    self.depth_trees[filename].add_identifier(function_identifier)
+            filename = value.get_file_name()
+            if filename in self.files:
+                self.files[filename].add_function(name)
+                function_identifier = Identifier(name=name, line_number=1,
+                                                 type_='FUNCTION_DECLARE',
+                                                 file=filename, node_id=None,
+                                                 pdg=value, parameter_count=parameter_count)
+
+                # add to the root node
+                self.depth_trees[filename].add_identifier(function_identifier)
 
     @staticmethod
     def get_parameter_count(pdg: PDG):
@@ -312,122 +535,107 @@ class Package:
                           visited: set,
                           result: Result):
         """
-        behavior generation util
+        behavior generation util, a depth-first traversal from current_node with an explicit stack,
+        an edge is processed when it is popped, in the same order as the recursive traversal
         """
-        if former_node == current_node:
-            in_edge = None
-        else:
-            in_edge = pdg.get_edges()[(former_node.get_id(), current_node.get_id())]
-        if current_node.get_id() not in visited:
-            result.add_node(current_node)
-
-            visited.add(current_node.get_id())
-            if current_node.is_entrance():
-                pass
-            elif current_node.get_node_type() == 'RETURN':
-
-                result.set_return_node(current_node)
-                result.add_edge(former_node.get_id(), current_node.get_id(), in_edge.get_attr())
-                current_node.set_is_return_value(True)
-            elif current_node.get_node_type() == 'METHOD_PARAMETER_IN':
-
-                result.add_edge(former_node.get_id(), current_node.get_id(), in_edge.get_attr())
-                parameter_name = current_node.get_name()
-                if parameter_name != 'this':
-                    identifier = Identifier(name=parameter_name,
-                                            line_number=current_node.get_line_number(),
-                                            type_='IDENTIFIER',
-                                            node_id=current_node.get_id(),
-                                            pdg=pdg,
-                                            file=filename)
-                    self.depth_trees[filename].add_identifier(identifier)
-
-            elif current_node.get_node_type() == 'CALL':
-
-                # call node process
-                self.call_node_process(current_node=current_node, former_node=former_node, pdg=pdg, filename=filename,
-                                       result=result, in_edge=in_edge)
+        stack = [(current_node, former_node)]
+        while stack:
+            current_node, former_node = stack.pop()
+            if former_node == current_node:
+                in_edge = None
             else:
+                in_edge = pdg.get_edges()[(former_node.get_id(), current_node.get_id())]
+            if current_node.get_id() not in visited:
+                result.add_node(current_node)
 
-                result.add_edge(former_node.get_id(), current_node.get_id(), in_edge.get_attr())
-                pass
-
-            out_edges = pdg.get_out_edges()
-            if current_node.get_id() in out_edges:
-
-                successive_node_ids = out_edges[current_node.get_id()]
-                node_id_list = []
-                for successive_node_id in successive_node_ids:
-                    out_edge = pdg.get_edges()[(current_node.get_id(), successive_node_id)]
-
-                    if self.get_type_of_edge(out_edge) == 'CFG':
-                        node_id_list.insert(0, ('CFG', successive_node_id))
-                    else:
-                        node_id_list.append(('DDG', successive_node_id))
-
-                start_index = 0
-                for tuple_ in node_id_list:
-                    if tuple_[0] == 'CFG':
-                        start_index += 1
-
-                sorted_array = node_id_list[start_index:]
-                sorted_array = sorted(sorted_array, key=lambda x: pdg.get_nodes()[x[1]].get_line_number())
-                node_id_list = node_id_list[:start_index] + sorted_array
-
-                for node_id in node_id_list:
-                    self.behavior_gen_util(current_node=pdg.get_nodes()[node_id[1]], former_node=current_node, pdg=pdg,
-                                           filename=filename, visited=visited, result=result)
-        else:
-
-            type_of_in_edge = self.get_type_of_edge(in_edge)
-            if current_node.get_node_type() == '<operator>.formatString':
+                visited.add(current_node.get_id())
+                if current_node.is_entrance():
+                    pass
+                elif current_node.get_node_type() == 'RETURN':
 
-                if former_node.get_call_type() == 'FUNCTION_CALL' or former_node.get_call_type() == 'LOCAL_MODULE_CALL':
+                    result.set_return_node(current_node)
+                    result.add_edge(former_node.get_id(), current_node.get_id(), in_edge.get_attr())
+                    current_node.set_is_return_value(True)
+                elif current_node.get_node_type() == 'METHOD_PARAMETER_IN':
 
-                    self.add_the_return_value_to_current_node(former_node, current_node, in_edge, result)
+                    result.add_edge(former_node.get_id(), current_node.get_id(), in_edge.get_attr())
+                    parameter_name = current_node.get_name()
+                    if parameter_name != 'this':
+                        identifier = Identifier(name=parameter_name,
+                                                line_number=current_node.get_line_number(),
+                                                type_='IDENTIFIER',
+                                                node_id=current_node.get_id(),
+                                                pdg=pdg,
+                                                file=filename)
+                        self.depth_trees[filename].add_identifier(identifier)
+
+                elif current_node.get_node_type() == 'CALL':
+
+                    # call node process
+                    self.call_node_process(current_node=current_node, former_node=former_node, pdg=pdg,
+                                           filename=filename, result=result, in_edge=in_edge)
                 else:
 
                     result.add_edge(former_node.get_id(), current_node.get_id(), in_edge.get_attr())
-            elif type_of_in_edge == 'DDG':
+                    pass
+
+                # the first successor is on the top of the stack
+                nodes = pdg.get_nodes()
+                for successive_node_id in reversed(pdg.get_ordered_successors(current_node.get_id())):
+                    stack.append((nodes[successive_node_id], current_node))
+            else:
 
-                if current_node.get_call_type() == 'ASSIGNMENT':
+                type_of_in_edge = pdg.get_edge_type(former_node.get_id(), current_node.get_id())
+                if current_node.get_node_type() == '<operator>.formatString':
 
                     if (former_node.get_call_type() == 'FUNCTION_CALL' or
                             former_node.get_call_type() == 'LOCAL_MODULE_CALL'):
+
                         self.add_the_return_value_to_current_node(former_node, current_node, in_edge, result)
                     else:
 
                         result.add_edge(former_node.get_id(), current_node.get_id(), in_edge.get_attr())
-                elif (current_node.get_call_type() == 'FUNCTION_CALL' or
-                      current_node.get_call_type() == 'LOCAL_MODULE_CALL' or
-                      current_node.get_call_type() == 'lambda'):
+                elif type_of_in_edge == 'DDG':
+
+                    if current_node.get_call_type() == 'ASSIGNMENT':
+
+                        if (former_node.get_call_type() == 'FUNCTION_CALL' or
+                                former_node.get_call_type() == 'LOCAL_MODULE_CALL'):
+                            self.add_the_return_value_to_current_node(former_node, current_node, in_edge, result)
+                        else:
 
-                    result_of_call = current_node.get_diagram_of_call()
-                    if result_of_call:
+                            result.add_edge(former_node.get_id(), current_node.get_id(), in_edge.get_attr())
+                    elif (current_node.get_call_type() == 'FUNCTION_CALL' or
+                          current_node.get_call_type() == 'LOCAL_MODULE_CALL' or
+                          current_node.get_call_type() == 'lambda'):
 
-                        entrance_of_result = result_of_call.get_entrance_node()
-                        if entrance_of_result:
+                        result_of_call = current_node.get_diagram_of_call()
+                        if result_of_call:
 
-                            if (former_node.get_call_type() == 'FUNCTION_CALL' or
-                                    former_node.get_call_type() == 'LOCAL_MODULE_CALL'):
+                            entrance_of_result = result_of_call.get_entrance_node()
+                            if entrance_of_result:
 
-                                self.add_the_return_value_to_current_node(former_node, current_node, in_edge, result)
+                                if (former_node.get_call_type() == 'FUNCTION_CALL' or
+                                        former_node.get_call_type() == 'LOCAL_MODULE_CALL'):
 
-                            else:
+                                    self.add_the_return_value_to_current_node(former_node, current_node, in_edge,
+                                                                              result)
+
+                                else:
+
+                                    result.add_edge(former_node.get_id(), current_node.get_id(), in_edge.get_attr())
 
                                 result.add_edge(former_node.get_id(), current_node.get_id(), in_edge.get_attr())
 
-                            result.add_edge(former_node.get_id(), current_node.get_id(), in_edge.get_attr())
+                            else:
 
-                        else:
+                                result.add_edge(former_node.get_id(), current_node.get_id(), in_edge.get_attr())
+                    else:
+                        result.add_edge(former_node.get_id(), current_node.get_id(), in_edge.get_attr())
 
-                            result.add_edge(former_node.get_id(), current_node.get_id(), in_edge.get_attr())
                 else:
                     result.add_edge(former_node.get_id(), current_node.get_id(), in_edge.get_attr())
 
-            else:
-                result.add_edge(former_node.get_id(), current_node.get_id(), in_edge.get_attr())
-
     def add_the_return_value_to_current_node(self, former_node: PDGNode, current_node: PDGNode, in_edge: Edge,
                                              result: Result):
         result_of_call = former_node.get_diagram_of_call()
@@ -500,7 +708,7 @@ class Package:
             result.add_edge(former_node.get_id(), current_node.get_id(), in_edge.get_attr())
             code = current_node.get_code()
             new_query = '(new_expression(identifier)@id)'
-            ast_parser = ASTParser(code, 'javascript')
+            ast_parser = self.ast_cache.parse(code)
             new_object = ast_parser.query_oneshot(new_query)
             if new_object is not None:
                 new_object = new_object.text.decode()
@@ -636,7 +844,7 @@ class Package:
 
         require_code = current_node.get_code()
         query_str = '(call_expression(arguments(string(string_fragment)@ar)))'
-        ast_parser = ASTParser(require_code, 'javascript')
+        ast_parser = self.ast_cache.parse(require_code)
         parser_res = ast_parser.query_oneshot(query_str)
         import_entity = None
         if parser_res is not None:
@@ -660,17 +868,12 @@ class Package:
                 if normpath in self.files:
 
                     # local module process and connected use cfg
-                    find_pdg = False
-                    for key, pdg in self.pdg_dict.items():
-                        if pdg.get_name() == ':program' and pdg.get_file_name() == normpath:
-                            self.pdg_analyzed[key] = True
-                            require_result = self.behavior_gen(normpath, pdg, 'program')
-                            result.add_edge(current_node.get_id(), require_result.get_entrance_node().get_id(), ['CFG'])
-                            joint(result, require_result)
-                            find_pdg = True
-                            break
-                    if not find_pdg:
-                        pass
+                    key = self.get_pdg_key(normpath, ':program')
+                    if key is not None:
+                        self.pdg_analyzed[key] = True
+                        require_result = self.behavior_gen(normpath, self.pdg_dict[key], 'program')
+                        result.add_edge(current_node.get_id(), require_result.get_entrance_node().get_id(), ['CFG'])
+                        joint(result, require_result)
 
     def function_or_method_call_process(self,
                                         current_node: PDGNode,
@@ -682,101 +885,18 @@ class Package:
                                         ):
         current_node.set_call_type('CALL')
         code = current_node.get_code()
-        ast_parser = ASTParser(code, 'javascript')
-
-        # tree-sitter query
-        call_expression = """
-                            (expression_statement
-	                            (call_expression
-    	                            (identifier)@id
-                                )
-                            )@ex
-        """
-
-        subscript_expression = """
-                                (expression_statement
-	                                (call_expression
-    	                                (subscript_expression)@su
-                                    )
-                                )@ex
-        """
-
-        member_expression_1 = """
-                            (expression_statement
-	                            (call_expression
-		                            function: (member_expression
-			                            object:(identifier)@identifier
-			                            property:(property_identifier)@property
-		                            )@member_expression
-	                            )
-                            )@ex
-        """
-
-        member_expression_2 = """
-                            (expression_statement
-	                            (call_expression
-                                    function: (member_expression
-                                        object:(call_expression
-                                            (member_expression
-                                                object: (identifier)@identifier
-                                                property: (property_identifier)@pro_identifier
-                                                )
-                                            )@call_expression
-                                        property:(property_identifier)@out_pro_identifier
-                                    )@member_expression
-                                )
-                            )@ex
-        """
-
-        member_expression_3 = """
-                            (expression_statement
-                                (call_expression
-                                    function: (member_expression
-                                        object:(member_expression
-                                            object:(identifier)@identifier
-                                            property:(property_identifier)@inner_property_identifier
-                                        )
-                                        property:(property_identifier)@outer_property_identifier
-                                    )@member_expression
-                                )
-                            )@ex
-        """
-
-        require_member_expression = """
-                                    (expression_statement
-                                        (call_expression
-                                            (member_expression
-                                                object: (call_expression
-                                                    function: (identifier)@identifier
-                                                    arguments: (arguments
-                                                        (string)@string
-                                                    )
-                                                )
-                                                property: (property_identifier)@property_identifier
-                                            )
-                                        )
-                                    )@ex
-        """
-
-        error_member_call_expression = '(ERROR(member_expression(call_expression(identifier))@ca(property_identifier)@pro))'
-
-        error_member_expression = """
-                                (ERROR
-                                    (member_expression
-                                        object: (identifier)@identifier
-                                        property: (property_identifier)@pro_identifier
-                                    )
-                                )@ex
-        """
-
-        matched_subscript = ast_parser.query(subscript_expression)
-        matched_call_expression = ast_parser.query(call_expression)
-        error_member_call_expression = ast_parser.query(error_member_call_expression)
-        error_member_expression = ast_parser.query(error_member_expression)
-        matched_member_expression_1 = ast_parser.query(member_expression_1)
-        matched_member_expression_2 = ast_parser.query(member_expression_2)
-        matched_member_expression_3 = ast_parser.query(member_expression_3)
-        require_member_expression = ast_parser.query(require_member_expression)
+        ast_parser = self.ast_cache.parse(code)
+
+        # all call site shapes in one query, the captures are grouped by shape
+        shapes = ast_parser.query_by_prefix(CALL_SHAPE_QUERY)
+        matched_subscript = shapes.get('subscript_expression', [])
+        matched_call_expression = shapes.get('call_expression', [])
+        error_member_call_expression = shapes.get('error_member_call_expression', [])
+        error_member_expression = shapes.get('error_member_expression', [])
+        matched_member_expression_1 = shapes.get('member_expression_1', [])
+        matched_member_expression_2 = shapes.get('member_expression_2', [])
+        matched_member_expression_3 = shapes.get('member_expression_3', [])
+        require_member_expression = shapes.get('require_member_expression', [])
 
         if matched_call_expression:
             ex = matched_call_expression[0][0]
@@ -998,26 +1118,24 @@ class Package:
         if not file_path.endswith('.js'):
             file_path = file_path + '.js'
         local_call_result = None
-        find_pdg = False
-        for key, value in self.pdg_dict.items():
-            if value.get_name() == function and value.get_file_name() == file_path:
-                find_pdg = True
-                if self.depth_trees[file_path].function_in_depth(function):
-                    return None
-                self.depth_trees[file_path].add_depth(function)
-                self.pdg_analyzed[key] = True
+        key = self.get_pdg_key(file_path, function)
+        if key is not None:
+            value = self.pdg_dict[key]
+            if self.depth_trees[file_path].function_in_depth(function):
+                return None
+            self.depth_trees[file_path].add_depth(function)
+            self.pdg_analyzed[key] = True
 
-                local_module_call_entrance_id = value.get_first_node_id()
+            local_module_call_entrance_id = value.get_first_node_id()
 
-                result.add_edge(current_node.get_id(), local_module_call_entrance_id, ['DDG'])
-                local_call_result = self.behavior_gen(file_path, value, 'local module')
-                self.depth_trees[file_path].delete_last_depth()
-                break
+            result.add_edge(current_node.get_id(), local_module_call_entrance_id, ['DDG'])
+            local_call_result = self.behavior_gen(file_path, value, 'local module')
+            self.depth_trees[file_path].delete_last_depth()
         return local_call_result
 
     def right_call_is_require(self, identifier: Identifier, former_node: PDGNode, current_node: PDGNode,
                               right_node: CPGNode, result: Result, in_edge: Edge):
-        ast_parser = ASTParser(right_node.get_value('CODE'), 'javascript')
+        ast_parser = self.ast_cache.parse(right_node.get_value('CODE'))
         import_entity_query_expression = '(call_expression(arguments(string(string_fragment)@ar)))'
         import_entity = ast_parser.query_oneshot(import_entity_query_expression)
         if import_entity is not None:
@@ -1081,7 +1199,7 @@ class Package:
             right_ast_of_child_ast = child_ast[1]
             imported_func = right_ast_of_child_ast.get_value('CODE')
             query_str = '(call_expression(arguments(string(string_fragment)@ar)))'
-            ast_parser = ASTParser(left_ast_code, 'javascript')
+            ast_parser = self.ast_cache.parse(left_ast_code)
             query_res = ast_parser.query_oneshot(query_str)
             import_entity = None
             if query_res is not None:
@@ -1175,7 +1293,7 @@ class Package:
     def right_is_block(self, identifier: Identifier, former_node: PDGNode, current_node: PDGNode,
                        right_node: CPGNode, depth_tree: DepthTree, result: Result, in_edge: Edge, pdg):
         result.add_edge(former_node.get_id(), current_node.get_id(), in_edge.get_attr())
-        ast_parser = ASTParser(right_node.get_value('CODE'), 'javascript')
+        ast_parser = self.ast_cache.parse(right_node.get_value('CODE'))
         new_query = '(new_expression(identifier)@id)'
         new_object = ast_parser.query_oneshot(new_query)
         if new_object is not None:
@@ -1578,9 +1696,7 @@ class Package:
                 if re.match(r'<lambda>\d+', code):
 
                     # find lambda
-                    for key, value in self.pdg_dict.items():
-                        if value.get_full_name() == method_full_name:
-                            return value
+                    return self.pdg_by_full_name.get(method_full_name)
             else:
                 return None
         else:
@@ -1644,7 +1760,7 @@ class Package:
 
                 elif label == 'IDENTIFIER':
                     parameter_code = parameter.get_value('CODE')
-                    ast_parser = ASTParser(parameter_code, 'javascript')
+                    ast_parser = self.ast_cache.parse(parameter_code)
                     identifier_query_str = '((identifier)@id)'
                     identifiers = ast_parser.query(identifier_query_str)
                     if identifiers:
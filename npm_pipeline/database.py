@@ -1,4 +1,4 @@
-from db_instance import DatabaseConnection
+from npm_pipeline.knowledge_base import get_knowledge_base, flush, set_log_pipeline
 import llm as llm
 import requests
 import json
@@ -9,34 +9,37 @@ import shutil
 import comment.third as comment_fetch
 from legal_module_name import is_legal_module_name
 
+# categorise an api found without category during the scan, False leaves it to the bulk job of categorise_api.py
+categorise_on_scan = True
+
+
+def set_categorise_on_scan(value: bool):
+    global categorise_on_scan
+    categorise_on_scan = value
+
 
 def find_in_database(module_name, eco):
     """
     search the module in database
     """
-    db = DatabaseConnection('remote')
+    db = get_knowledge_base()
     if is_legal_module_name(module_name):
         builtin_query_result = db.package_in_builtin(module_name, eco)
         if len(builtin_query_result) != 0:
-            db.close()
             return 'BUILTIN'
         else:
             third_part_result = db.package_in_third_part(module_name, eco)
             if len(third_part_result) != 0:
-                db.close()
                 return 'THIRD_PART'
             else:
-                db.close()
                 return 'NOT_IN'
     else:
-        db.close()
         return 'NOT_IN'
 
 
 def is_function_of_module(module_name, function_name, eco, log):
-    db = DatabaseConnection('remote')
+    db = get_knowledge_base()
     query_result = db.function_of_the_module(eco, module_name, function_name, 'third')
-    db.close()
     if len(query_result) != 0:
         log.info(f"`{function_name}` is the function from module `{module_name}`")
         return True
@@ -74,7 +77,7 @@ def add_to_database(module_name: str, dependency_list: list, eco: str):
             print(f"No URL found in module: {download_name}")
         else:
             fileName = link.split("/")[-1]
-            db = DatabaseConnection('remote')
+            db = get_knowledge_base()
             try:
                 urllib.request.urlretrieve(link, os.path.join(npm_package_download_folder, fileName))
 
@@ -91,55 +94,59 @@ def add_to_database(module_name: str, dependency_list: list, eco: str):
                     raise Exception(f'file: {fileName} with unsupported type')
 
                 function_list = comment_fetch.get_function_list(dst_path, "javascript")
-                for func in function_list:
-                    db.to_db(download_name, func.file, func.name, func.qualifiedname, func.comment,
-                             func.parameters_num, func.code, f'{eco}_third')
-                db.close()
+                db.to_db_many(download_name, [(func.file, func.name, func.qualifiedname, func.comment,
+                                               func.parameters_num, func.code) for func in function_list],
+                              f'{eco}_third')
                 return True
             except Exception as e:
-                db.close()
                 return False
     else:
         return False
 
 
+async def categorise_async(row, db_name):
+    """
+    categorise an api by its comment, and by the summary of its code for a third-part api
+    :param row: row of the builtin or third table, id, package, file, name, qualifiedname, comment, parameters_num,
+    category, summary and, in the third table, code
+    :return: category list, category string, code summary or None for a builtin api
+    """
+    if db_name == 'third':
+        code_summary = await llm.llm_code_summary_async(row[9])
+        category_list = await llm.llm_classification_comment_with_code_summary_async(row[5], code_summary)
+    else:
+        code_summary = None
+        category_list = await llm.llm_classification_async(row[5])
+    category_string = '-'.join(category_list)
+    if 'Others' in category_string:
+        category_string = 'Others'
+    return category_list, category_string, code_summary
+
+
 def is_sensitive_call(qualifier, call_name, eco, db_name, category=None):
-    db = DatabaseConnection('remote')
+    db = get_knowledge_base()
     res = db.query(eco, db_name, 'package', qualifier, 'name', call_name)
     if len(res) != 0:
         category_str = res[0][7]
         if category_str is not None and category_str != '':
             if category_str == 'Others':
-                db.close()
                 return False, 'Others'
             else:
                 category_list = category_str.split('-')
-                db.close()
                 return True, category_list
         else:
+            if not categorise_on_scan:
+                # the row is categorised offline by categorise_api.py
+                return False, 'Others'
+
             # GPT
-            if db_name == 'third':
-                comment = res[0][5]
-                code = res[0][9]
-                code_summary = llm.llm_code_summary(code)
-                category_list = llm.llm_classification_comment_with_code_summary(comment, code_summary)
-                category_string = '-'.join(category_list)
-                if 'Others' in category_string:
-                    category_string = 'Others'
-                db.update(eco, db_name, res[0][0], 'category', category_string)
+            category_list, category_string, code_summary = llm.run(categorise_async(res[0], db_name))
+            db.update(eco, db_name, res[0][0], 'category', category_string)
+            if code_summary is not None:
                 db.update(eco, db_name, res[0][0], 'summary', code_summary)
-            else:
-                comment = res[0][5]
-                category_list = llm.llm_classification(comment)
-                category_string = '-'.join(category_list)
-                if 'Others' in category_string:
-                    category_string = 'Others'
-                db.update(eco, db_name, res[0][0], 'category', category_string)
             if 'Others' in category_string:
-                db.close()
                 return False, 'Others'
             else:
-                db.close()
                 return True, category_list
     else:
         if db_name == 'third':
@@ -157,8 +164,6 @@ def is_sensitive_call(qualifier, call_name, eco, db_name, category=None):
 
         db.insert(eco, db_name, qualifier, call_name, qualifier + '.' + call_name, category_string, code_assumption)
         if 'Others' in category_string:
-            db.close()
             return False, 'Others'
         else:
-            db.close()
             return True, category_list
